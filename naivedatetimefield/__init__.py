@@ -1,11 +1,27 @@
 import datetime
+import functools
 import sys
 
 import pytz
 
 import django
 from django.core import exceptions, checks
-from django.db.models import DateTimeField, Func, Value
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.backends.utils import typecast_timestamp
+from django.db.models import (
+    DateField,
+    DateTimeField,
+    DurationField,
+    ExpressionWrapper,
+    Func,
+    IntegerField,
+    Manager,
+    QuerySet,
+    TimeField,
+    Value,
+)
+from django.db.models.expressions import Col
 from django.db.models.functions.datetime import TruncBase, Extract, ExtractYear
 from django.db.models.lookups import (
     Exact,
@@ -29,6 +45,24 @@ def _conn_tz(connection):
         return connection.timezone
 
 
+# Python equivalents of the naive transforms that can be materialized
+_PYTHON_PARTS = {
+    "date": lambda value: value.date(),
+    "time": lambda value: value.time(),
+    "year": lambda value: value.year,
+    "iso_year": lambda value: value.isocalendar()[0],
+    "quarter": lambda value: (value.month + 2) // 3,
+    "month": lambda value: value.month,
+    "week": lambda value: value.isocalendar()[1],
+    "day": lambda value: value.day,
+    "week_day": lambda value: value.isoweekday() % 7 + 1,
+    "iso_week_day": lambda value: value.isoweekday(),
+    "hour": lambda value: value.hour,
+    "minute": lambda value: value.minute,
+    "second": lambda value: value.second,
+}
+
+
 class NaiveDateTimeField(DateTimeField):
     description = _("Naive Date (with time)")
 
@@ -36,6 +70,83 @@ class NaiveDateTimeField(DateTimeField):
         "tzaware": _("TZ-aware datetimes cannot be coerced to naive datetimes"),
     }
 
+    INTERN_CACHE_SIZE = 4096
+
+    def __init__(self, *args, **kwargs):
+        """
+        ``materialize`` is a sequence of transform names (e.g. "date",
+        "hour") to store in indexed companion columns named
+        ``<field name>_<transform>``. In querysets of a MaterializedManager,
+        lookups and Trunc/Extract expressions for those transforms read the
+        companion column instead of computing the value for every row.
+
+        ``intern`` makes every query share a single datetime instance
+        between rows with the same value, and convert each distinct value
+        only once. It is either True or the maximum number of distinct
+        values to keep per query (``INTERN_CACHE_SIZE`` when True); values
+        seen after the cache is full are converted as usual. This saves
+        time and memory when loading many rows with few distinct values,
+        e.g. bucketed or minute resolution timestamps.
+        """
+        self.materialize = tuple(kwargs.pop("materialize", ()))
+        self.intern = kwargs.pop("intern", False)
+        if self.intern:
+            _enable_interning()
+        super(NaiveDateTimeField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(NaiveDateTimeField, self).deconstruct()
+        if self.materialize:
+            kwargs["materialize"] = self.materialize
+        if self.intern:
+            kwargs["intern"] = self.intern
+        return name, path, args, kwargs
+
+    @property
+    def intern_cache_size(self):
+        if self.intern is True:
+            return self.INTERN_CACHE_SIZE
+        return self.intern or 0
+
+    def check(self, **kwargs):
+        errors = super(NaiveDateTimeField, self).check(**kwargs)
+        errors.extend(self._check_materialize())
+        return errors
+
+    def _check_materialize(self):
+        invalid = [part for part in self.materialize if part not in _PYTHON_PARTS]
+        if invalid:
+            return [
+                checks.Error(
+                    "Cannot materialize %s." % ", ".join(invalid),
+                    hint="Choose from %s." % ", ".join(_PYTHON_PARTS),
+                    obj=self,
+                    id="naivedatetimefield.E001",
+                )
+            ]
+        return []
+
+    def materialized_name(self, part):
+        return "%s_%s" % (self.name, part)
+
+    def contribute_to_class(self, cls, name, *args, **kwargs):
+        super(NaiveDateTimeField, self).contribute_to_class(cls, name, *args, **kwargs)
+        # Historical models used by migrations get the companion fields
+        # from the migration state instead.
+        if cls._meta.abstract or cls.__module__ == "__fake__":
+            return
+        existing = {field.name for field in cls._meta.local_fields}
+        for part in self.materialize:
+            if part in _PYTHON_PARTS and self.materialized_name(part) not in existing:
+                field_class = _MATERIALIZED_FIELD_CLASSES.get(
+                    part, MaterializedIntegerField
+                )
+                cls.add_to_class(
+                    self.materialized_name(part), field_class(source=name, part=part)
+                )
+        if self.materialize and not hasattr(cls.save_base, "materialized"):
+            cls.save_base = _save_materialized(cls.save_base)
+
     def get_internal_type(self):
         return "DateTimeField"
 
@@ -149,6 +260,49 @@ class NaiveDateTimeField(DateTimeField):
             return timezone.make_naive(value, _conn_tz(connection))
         return value
 
+    def get_db_converters(self, connection):
+        converters = super(NaiveDateTimeField, self).get_db_converters(connection)
+        if not self.intern:
+            return converters
+        # The backend's own converters are skipped for interned fields (see
+        # _install_interning) and run here instead, once per distinct value.
+        backend_converters = getattr(connection.ops, "naive_backend_converters", None)
+        if backend_converters is not None:
+            converters = backend_converters(Col(None, self)) + converters
+        return [InterningConverter(converters, self.intern_cache_size)]
+
+    def from_db_values(self, values, connection, cache=None):
+        """
+        Convert a whole column of raw database values in one call.
+
+        This replaces both the backend converters and from_db_value for a
+        column of this field, so values that some backends store as text
+        are parsed straight to naive datetimes instead of being made aware
+        and naive again one at a time.
+
+        With ``intern``, converted values are shared through ``cache``, a
+        dict that callers can keep across calls for the same query.
+        """
+        tz = _conn_tz(connection)
+        size = self.intern_cache_size
+        if cache is None:
+            cache = {}
+        converted = []
+        for value in values:
+            if size:
+                if value in cache:
+                    converted.append(cache[value])
+                    continue
+                raw = value
+            if isinstance(value, str):
+                value = parse_datetime(value)
+            elif value is not None and timezone.is_aware(value):
+                value = timezone.make_naive(value, tz)
+            if size and len(cache) < size:
+                cache[raw] = value
+            converted.append(value)
+        return converted
+
     def pre_save(self, model_instance, add):
         if self.auto_now or (self.auto_now_add and add):
             value = timezone.make_naive(timezone.now())
@@ -158,6 +312,188 @@ class NaiveDateTimeField(DateTimeField):
             return super(NaiveDateTimeField, self).pre_save(model_instance, add)
 
 
+def _materialized_names(model, names):
+    """
+    The names of the companion columns of the fields in ``names``.
+    """
+    companions = set()
+    for field in model._meta.concrete_fields:
+        if isinstance(field, NaiveDateTimeField) and field.name in names:
+            companions.update(field.materialized_name(part) for part in field.materialize)
+    return companions
+
+
+def _save_materialized(save_base):
+    """
+    Wrap a model's save_base() so that saving only some fields, with
+    update_fields or after loading a deferred instance, also saves the
+    companion columns of the materialized fields among them.
+    """
+
+    @functools.wraps(save_base)
+    def wrapper(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = frozenset(update_fields).union(
+                _materialized_names(self.__class__, update_fields)
+            )
+        return save_base(self, *args, **kwargs)
+
+    wrapper.materialized = True
+    return wrapper
+
+
+class MaterializedPartMixin(object):
+    """
+    A column holding a transform of a NaiveDateTimeField on the same model,
+    added by NaiveDateTimeField(materialize=...) and kept up to date when
+    the model is saved, and by MaterializedQuerySet.update() and
+    bulk_update(). Rows written otherwise, e.g. with raw SQL or another
+    manager's update(), must be fixed with refresh_materialized().
+    """
+
+    part_defaults = {"editable": False, "blank": True, "null": True, "db_index": True}
+
+    def __init__(self, source, part, **kwargs):
+        self.source = source
+        self.part = part
+        for key, default in self.part_defaults.items():
+            kwargs.setdefault(key, default)
+        super(MaterializedPartMixin, self).__init__(**kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(MaterializedPartMixin, self).deconstruct()
+        kwargs.update(source=self.source, part=self.part)
+        for key, default in self.part_defaults.items():
+            if getattr(self, key) == default:
+                kwargs.pop(key, None)
+            else:
+                kwargs[key] = getattr(self, key)
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.model._meta.get_field(self.source).attname)
+        if value is not None:
+            value = _PYTHON_PARTS[self.part](value)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+class MaterializedDateField(MaterializedPartMixin, DateField):
+    pass
+
+
+class MaterializedTimeField(MaterializedPartMixin, TimeField):
+    pass
+
+
+class MaterializedIntegerField(MaterializedPartMixin, IntegerField):
+    pass
+
+
+_MATERIALIZED_FIELD_CLASSES = {
+    "date": MaterializedDateField,
+    "time": MaterializedTimeField,
+}
+
+
+def _materialized_transform(field, part, value):
+    transform = NaiveDateTimeField.get_lookups()[part](value)
+    transform.use_materialized = False
+    return transform
+
+
+class MaterializedQuerySet(QuerySet):
+    """
+    A QuerySet whose lookups and Trunc/Extract expressions read the
+    companion columns of materialized NaiveDateTimeFields, and whose
+    update() (and so bulk_update()) also updates the companion columns of
+    the fields it sets.
+
+    Only use it for models whose rows are written through save(), this
+    queryset, or followed by refresh_materialized(), as the companion
+    columns would otherwise be out of date and return the wrong rows.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(MaterializedQuerySet, self).__init__(*args, **kwargs)
+        # Copied along with the query by every clone
+        self.query.use_materialized = True
+
+    def update(self, **kwargs):
+        opts = self.model._meta
+        for field in opts.concrete_fields:
+            if not isinstance(field, NaiveDateTimeField) or field.name not in kwargs:
+                continue
+            value = kwargs[field.name]
+            for part in field.materialize:
+                if hasattr(value, "resolve_expression"):
+                    companion = _materialized_transform(
+                        field, part, ExpressionWrapper(value, output_field=field)
+                    )
+                elif value is None:
+                    companion = None
+                else:
+                    companion = _PYTHON_PARTS[part](field.to_python(value))
+                kwargs.setdefault(field.materialized_name(part), companion)
+        return super(MaterializedQuerySet, self).update(**kwargs)
+
+    update.alters_data = True
+
+
+MaterializedManager = Manager.from_queryset(MaterializedQuerySet, "MaterializedManager")
+
+
+def refresh_materialized(queryset, *field_names):
+    """
+    Recompute the materialized columns of ``queryset`` in the database, for
+    rows written without Model.save(), e.g. with QuerySet.update() or when
+    backfilling a newly materialized column. Returns the number of rows
+    updated.
+    """
+    updates = {}
+    for field in queryset.model._meta.concrete_fields:
+        if not isinstance(field, NaiveDateTimeField):
+            continue
+        if field_names and field.name not in field_names:
+            continue
+        for part in field.materialize:
+            updates[field.materialized_name(part)] = _materialized_transform(
+                field, part, field.name
+            )
+    if not updates:
+        return 0
+    return queryset.update(**updates)
+
+
+class InterningConverter(object):
+    """
+    A database converter running ``converters`` once per distinct raw
+    value and returning the same object for every row with that value.
+
+    A new one is created each time a query's converters are collected, so
+    the cache lives as long as the query's results are being read. At most
+    ``size`` values are cached.
+    """
+
+    def __init__(self, converters, size):
+        self.converters = converters
+        self.size = size
+        self.cache = {}
+
+    def __call__(self, value, expression, connection):
+        try:
+            return self.cache[value]
+        except KeyError:
+            pass
+        raw = value
+        for converter in self.converters:
+            value = converter(value, expression, connection)
+        if len(self.cache) < self.size:
+            self.cache[raw] = value
+        return value
+
+
 class NaiveConvertValueMixin(object):
     def convert_value(self, value, expression, connection):
         if isinstance(self.output_field, NaiveDateTimeField):
@@ -168,15 +504,80 @@ class NaiveConvertValueMixin(object):
         )
 
 
+# SQL run by SQLite for naive truncate and extract operations. Django's own
+# functions parse every value in Python and convert it between timezones,
+# which does nothing for naive values.
+_SQLITE_EXTRACT = {
+    "year": "CAST(strftime('%%Y', {}) AS INTEGER)",
+    "iso_year": "django_naive_extract('iso_year', {})",
+    "quarter": "((CAST(strftime('%%m', {}) AS INTEGER) + 2) / 3)",
+    "month": "CAST(strftime('%%m', {}) AS INTEGER)",
+    "week": "django_naive_extract('week', {})",
+    "day": "CAST(strftime('%%d', {}) AS INTEGER)",
+    "week_day": "(CAST(strftime('%%w', {}) AS INTEGER) + 1)",
+    "iso_week_day": "((CAST(strftime('%%w', {}) AS INTEGER) + 6) %% 7 + 1)",
+    "hour": "CAST(strftime('%%H', {}) AS INTEGER)",
+    "minute": "CAST(strftime('%%M', {}) AS INTEGER)",
+    "second": "CAST(strftime('%%S', {}) AS INTEGER)",
+}
+
+_SQLITE_TRUNC = {
+    "year": "strftime('%%Y-01-01 00:00:00', {})",
+    "quarter": "django_naive_trunc('quarter', {})",
+    "month": "strftime('%%Y-%%m-01 00:00:00', {})",
+    "week": "strftime('%%Y-%%m-%%d 00:00:00', {}, '-6 days', 'weekday 1')",
+    "day": "strftime('%%Y-%%m-%%d 00:00:00', {})",
+    "hour": "strftime('%%Y-%%m-%%d %%H:00:00', {})",
+    "minute": "strftime('%%Y-%%m-%%d %%H:%%M:00', {})",
+    "second": "strftime('%%Y-%%m-%%d %%H:%%M:%%S', {})",
+    # Values are stored as str(datetime), so the time starts at character 12
+    "date": "date({})",
+    "time": "substr({}, 12)",
+}
+
+
 class NaiveAsSQLMixin(object):
     """
     The purpose of this mixin is to override the active timezone when
     generating SQL for truncate and extract operations, to effectively
     nullify the timezone conversion that Django unconditionally applies
     to datetime values.
+
+    On SQLite, naive values are truncated and extracted with strftime()
+    and small deterministic functions instead of Django's timezone-aware
+    user functions.
     """
 
+    use_materialized = True
+
+    def _materialized_col(self, compiler):
+        """
+        Return the column holding this transform's value precomputed, if the
+        field was declared with materialize=... for it and the query comes
+        from a MaterializedQuerySet.
+        """
+        if not getattr(compiler.query, "use_materialized", False):
+            return None
+        if not self.use_materialized or not isinstance(self.lhs, Col):
+            return None
+        field = self.lhs.target
+        if not isinstance(field, NaiveDateTimeField) or self.tzinfo is not None:
+            return None
+        if isinstance(self, Extract):
+            part = self.lookup_name
+        elif self.kind in ("date", "time") and self.kind == self.lookup_name:
+            part = self.kind
+        else:
+            return None
+        if part not in field.materialize:
+            return None
+        companion = field.model._meta.get_field(field.materialized_name(part))
+        return companion.get_col(self.lhs.alias)
+
     def as_sql(self, compiler, connection):
+        materialized = self._materialized_col(compiler)
+        if materialized is not None:
+            return compiler.compile(materialized)
         if isinstance(self.lhs.output_field, NaiveDateTimeField):
             if self.tzinfo is not None:
                 raise ValueError("tzinfo can only be used with DateTimeField.")
@@ -186,6 +587,36 @@ class NaiveAsSQLMixin(object):
                 return super(NaiveAsSQLMixin, self).as_sql(compiler, connection)
         return super(NaiveAsSQLMixin, self).as_sql(compiler, connection)
 
+    def _sqlite_template(self):
+        if isinstance(self, Extract):
+            return _SQLITE_EXTRACT.get(self.lookup_name)
+        template = _SQLITE_TRUNC.get(self.kind)
+        if self.kind in ("date", "time") or template is None:
+            return template
+        if isinstance(self.output_field, DateTimeField):
+            return template
+        if isinstance(self.output_field, DateField):
+            return "date(%s)" % template
+        return None
+
+    def as_sqlite(self, compiler, connection):
+        materialized = self._materialized_col(compiler)
+        if materialized is not None:
+            return compiler.compile(materialized)
+        template = None
+        if isinstance(self.lhs.output_field, NaiveDateTimeField):
+            template = self._sqlite_template()
+        if template is None:
+            return self.as_sql(compiler, connection)
+        if self.tzinfo is not None:
+            raise ValueError("tzinfo can only be used with DateTimeField.")
+        sql, params = compiler.compile(self.lhs)
+        if getattr(self, "kind", None) != "time":
+            # SQLite rounds fractional seconds to milliseconds, which can
+            # carry into the next day, so drop them first.
+            sql = "substr(%s, 1, 19)" % sql
+        return template.format(sql), params
+
 
 class AtTimeZone(Func):
     """
@@ -237,6 +668,163 @@ class AtTimeZone(Func):
         return getattr(self, "_output_field", None)
 
 
+class NaiveArithmeticMixin(object):
+    """
+    Keep the result of adding or subtracting an interval to a naive
+    expression naive. Django would otherwise resolve it to a DateTimeField
+    and make the value aware on the way out of the database.
+    """
+
+    def _combine(self, other, connector, reversed):
+        combined = super(NaiveArithmeticMixin, self)._combine(
+            other, connector, reversed
+        )
+        if connector in (self.ADD, self.SUB) and _is_interval(other):
+            return NaiveExpressionWrapper(combined, output_field=NaiveDateTimeField())
+        return combined
+
+
+def _is_interval(value):
+    if isinstance(value, datetime.timedelta):
+        return True
+    output_field = getattr(value, "_output_field_or_none", None)
+    return isinstance(output_field, DurationField)
+
+
+class NaiveExpressionWrapper(NaiveArithmeticMixin, ExpressionWrapper):
+    def as_sqlite(self, compiler, connection, **extra_context):
+        sql, params = self.as_sql(compiler, connection, **extra_context)
+        if django.VERSION < (3, 0):
+            # SQLite's interval arithmetic labels the result as UTC
+            sql = "replace(%s, '+00:00', '')" % sql
+        return sql, params
+
+
+class NaiveNow(NaiveArithmeticMixin, Func):
+    """
+    The current wall-clock time in ``tzinfo`` (the current timezone by
+    default, as used by ``auto_now``), evaluated by the database rather than
+    sent as a parameter. It matches ``timezone.make_naive(timezone.now())``.
+
+    Intervals can be added or subtracted to build relative filters, e.g.
+    ``filter(naive__gte=NaiveNow() - datetime.timedelta(hours=1))``.
+
+    On PostgreSQL this is based on CURRENT_TIMESTAMP, which is fixed for
+    the duration of the transaction.
+    """
+
+    template = "(CURRENT_TIMESTAMP AT TIME ZONE %%s)"
+    output_field = NaiveDateTimeField()
+
+    def __init__(self, tzinfo=None, **extra):
+        self.tzinfo = tzinfo
+        super(NaiveNow, self).__init__(**extra)
+
+    def get_tzname(self):
+        if self.tzinfo is None:
+            return timezone.get_current_timezone_name()
+        return timezone._get_timezone_name(self.tzinfo)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super(NaiveNow, self).as_sql(
+            compiler, connection, **extra_context
+        )
+        return sql, params + [self.get_tzname()]
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # SQLite's 'now' is fixed for the duration of the statement, unlike
+        # a call back into Python for the current time.
+        utc_now = "strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now')"
+        tzname = self.get_tzname()
+        if tzname == "UTC":
+            return utc_now, []
+        return "django_naive_from_utc(%s, %%s)" % utc_now, [tzname]
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # NOW() uses the session time zone, which Django doesn't set.
+        tzname = self.get_tzname()
+        if tzname == "UTC":
+            return "UTC_TIMESTAMP(6)", []
+        return "CONVERT_TZ(UTC_TIMESTAMP(6), 'UTC', %s)", [tzname]
+
+
+def _sqlite_naive_from_utc(value, tzname):
+    if value is None:
+        return None
+    value = parse_datetime(value).replace(tzinfo=pytz.utc)
+    return str(timezone.make_naive(value, pytz.timezone(tzname)))
+
+
+def _sqlite_naive_extract(lookup_type, value):
+    if value is None:
+        return None
+    year, week, _ = typecast_timestamp(value).isocalendar()
+    return year if lookup_type == "iso_year" else week
+
+
+def _sqlite_naive_trunc(kind, value):
+    if value is None:
+        return None
+    dt = typecast_timestamp(value)
+    # "quarter" is the only kind not handled with strftime()
+    month_in_quarter = dt.month - (dt.month - 1) % 3
+    return "%i-%02i-01 00:00:00" % (dt.year, month_in_quarter)
+
+
+def _register_sqlite_functions(sender, connection, **kwargs):
+    if connection.vendor == "sqlite":
+        conn = connection.connection
+        if sys.version_info >= (3, 8):
+            create_deterministic_function = functools.partial(
+                conn.create_function, deterministic=True
+            )
+        else:
+            create_deterministic_function = conn.create_function
+        create_deterministic_function("django_naive_extract", 2, _sqlite_naive_extract)
+        create_deterministic_function("django_naive_trunc", 2, _sqlite_naive_trunc)
+        conn.create_function("django_naive_from_utc", 2, _sqlite_naive_from_utc)
+
+
+connection_created.connect(_register_sqlite_functions)
+
+
+def _ops_get_db_converters(ops, expression):
+    output_field = expression.output_field
+    if isinstance(output_field, NaiveDateTimeField) and output_field.intern:
+        return []
+    return ops.naive_backend_converters(expression)
+
+
+def _install_interning(sender, connection, **kwargs):
+    """
+    Hand the backend's converters for interned fields over to the field,
+    which otherwise has no way to skip them for repeated values.
+    """
+    ops = connection.ops
+    if not hasattr(ops, "naive_backend_converters"):
+        ops.naive_backend_converters = ops.get_db_converters
+        ops.get_db_converters = functools.partial(_ops_get_db_converters, ops)
+
+
+_interning_enabled = False
+
+
+def _enable_interning():
+    """
+    Install the interning converters hook on this thread's connections and
+    on every new one, once a field using ``intern`` is declared.
+    Connections that don't get it still convert interned fields correctly,
+    only without skipping the backend's converters for repeated values.
+    """
+    global _interning_enabled
+    if _interning_enabled:
+        return
+    _interning_enabled = True
+    connection_created.connect(_install_interning)
+    for connection in connections.all():
+        _install_interning(None, connection)
+
+
 _monkeypatching = False
 
 
@@ -0,0 +1,369 @@
+"""
+An opt-in query analyzer that spots WHERE clauses wrapping an indexed
+NaiveDateTimeField column in a function call.
+
+Filters such as ``naive__hour__gte=9`` or ``naive__date=some_date`` compile to
+SQL that applies a Trunc/Extract function to the column, which stops the
+database from using an index on it. The analyzer hooks into
+``connection.execute_wrapper``, looks for those patterns in the SQL that is
+actually executed, optionally runs EXPLAIN on a sample of the offending
+queries and records where in the application the query came from.
+
+    with NaiveQueryAnalyzer(sample_rate=0.1) as analyzer:
+        ...
+    for offender in analyzer.offenders:
+        print(offender.column, offender.suggestion)
+"""
+import logging
+import os
+import random
+import re
+import threading
+import traceback
+import weakref
+from collections import namedtuple
+
+import django
+from django.apps import apps
+from django.db import DatabaseError, connections, transaction
+from django.db.backends.signals import connection_created
+
+from . import NaiveDateTimeField
+
+logger = logging.getLogger(__name__)
+
+Offender = namedtuple(
+    "Offender", ["sql", "column", "function", "suggestion", "stack", "plan"]
+)
+
+# Words that can precede a parenthesised group without it being a function call
+_SQL_KEYWORDS = {"AND", "OR", "NOT", "WHERE", "ON", "IN", "EXISTS", "HAVING", ""}
+
+_CLAUSE_END = re.compile(r"\s(GROUP BY|ORDER BY|HAVING|LIMIT|WINDOW|FOR UPDATE)\s")
+
+# Checked in order, e.g. django_datetime_extract also mentions "date"
+_SUGGESTIONS = [
+    (
+        re.compile(r"extract|strftime|DATE_FORMAT", re.IGNORECASE),
+        "Extracted parts cannot use an index on the column; add a year or "
+        "date range filter on the column itself to bound the scan.",
+    ),
+    (
+        re.compile(r"trunc", re.IGNORECASE),
+        "Filter on the range covered by the truncated value, e.g. "
+        "naive__gte=<bucket start>, naive__lt=<next bucket start>.",
+    ),
+    (
+        re.compile(r"date", re.IGNORECASE),
+        "Filter on a range instead of the date, e.g. "
+        "naive__gte=datetime(d.year, d.month, d.day), naive__lt=<next day>.",
+    ),
+]
+
+_DEFAULT_SUGGESTION = "Compare the column directly against a range of values."
+
+
+def _is_indexed(model, field):
+    if field.primary_key or field.db_index or field.unique:
+        return True
+    opts = model._meta
+    leading = [fields[0] for fields in opts.index_together + opts.unique_together]
+    for index in list(opts.indexes) + list(opts.constraints):
+        fields = getattr(index, "fields", None)
+        if fields:
+            leading.append(fields[0].lstrip("-"))
+    return field.name in leading
+
+
+def _suggestion(function):
+    # Ignore quoted table and column names
+    function = re.sub(r'"[^"]*"|`[^`]*`', "", function)
+    for pattern, suggestion in _SUGGESTIONS:
+        if pattern.search(function):
+            return suggestion
+    return _DEFAULT_SUGGESTION
+
+
+def _where_clause(sql):
+    """
+    Return the top-level WHERE clause of ``sql``, or an empty string.
+    """
+    start = sql.find(" WHERE ")
+    if start == -1:
+        return ""
+    where = sql[start:]
+    depth = 0
+    quote = None
+    for i, char in enumerate(where):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif depth == 0 and char == " " and _CLAUSE_END.match(where, i):
+            return where[:i]
+    return where
+
+
+def _enclosing_call(where, position):
+    """
+    Find the innermost unclosed parenthesis before ``position`` and return
+    the start and end of the function applied to it, or None if the column
+    is not wrapped in a function.
+    """
+    depth = 0
+    for i in range(position - 1, -1, -1):
+        char = where[i]
+        if char == ")":
+            depth += 1
+        elif char == "(":
+            if depth:
+                depth -= 1
+                continue
+            close = _matching_paren(where, i)
+            name = re.search(r"([A-Za-z_][\w.]*)\s*$", where[:i])
+            if name and name.group(1).upper() not in _SQL_KEYWORDS:
+                return name.start(1), close + 1
+            # A bare group like ("col" AT TIME ZONE 'UTC')::date
+            cast = re.match(r"::\w+", where[close + 1:])
+            if cast or "AT TIME ZONE" in where[i:close]:
+                return i, close + 1 + (cast.end() if cast else 0)
+            return None
+    return None
+
+
+def _outermost_call(where, position):
+    """
+    Return the SQL of the outermost function wrapping the column at
+    ``position``, or None if it isn't wrapped.
+    """
+    call = _enclosing_call(where, position)
+    while call is not None:
+        outer = _enclosing_call(where, call[0])
+        if outer is None:
+            return where[call[0]:call[1]]
+        call = outer
+    return None
+
+
+def _column_pattern(sql, table, column):
+    """
+    Return a pattern matching references to ``column`` in ``sql``, either
+    through the table name or through the aliases Django gives to joined and
+    subquery tables (``INNER JOIN "table" T3``, ``FROM "table" U0``), which it
+    leaves unquoted.
+    """
+    aliases = re.findall(re.escape(table) + r"\s+([A-Z]\d+)\b", sql)
+    names = [re.escape(table)] + [
+        r"(?<![\w\"`])%s" % alias for alias in sorted(set(aliases))
+    ]
+    return re.compile(r"(?:%s)\.%s" % ("|".join(names), re.escape(column)))
+
+
+def _matching_paren(text, start):
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(text) - 1
+
+
+class NaiveQueryAnalyzer(object):
+    """
+    Execute wrapper that records queries applying functions to indexed
+    NaiveDateTimeField columns in their WHERE clause.
+
+    ``sample_rate`` is the fraction of offending SELECT queries that are
+    passed through EXPLAIN, ``stack_depth`` limits the number of application
+    frames kept for each offender and ``max_offenders`` bounds memory use in
+    long running processes.
+    """
+
+    def __init__(
+        self,
+        using=None,
+        sample_rate=0.0,
+        stack_depth=5,
+        max_offenders=1000,
+        log=True,
+    ):
+        self.using = using
+        self.sample_rate = sample_rate
+        self.stack_depth = stack_depth
+        self.max_offenders = max_offenders
+        self.log = log
+        self.offenders = []
+        self._columns = {}
+        # Per thread, as installed analyzers are shared by all connections
+        self._local = threading.local()
+        self._wrapped = []
+        # Connections are per thread, so uninstall() can't find them all
+        # through django.db.connections
+        self._attached = weakref.WeakSet()
+
+    def __enter__(self):
+        for alias in self._aliases():
+            wrapper = connections[alias].execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrapped.append(wrapper)
+        return self
+
+    def __exit__(self, *exc_info):
+        while self._wrapped:
+            self._wrapped.pop().__exit__(*exc_info)
+
+    def install(self):
+        """
+        Attach the analyzer to current and future connections, for use in
+        long running processes rather than a ``with`` block.
+        """
+        for alias in self._aliases():
+            self._attach(connections[alias])
+        connection_created.connect(self._connection_created)
+
+    def uninstall(self):
+        connection_created.disconnect(self._connection_created)
+        for connection in list(self._attached):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+        self._attached.clear()
+
+    def _aliases(self):
+        if self.using is None:
+            return list(connections)
+        if isinstance(self.using, str):
+            return [self.using]
+        return list(self.using)
+
+    def _attach(self, connection):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+        self._attached.add(connection)
+
+    def _connection_created(self, sender, connection, **kwargs):
+        if connection.alias in self._aliases():
+            self._attach(connection)
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if not getattr(self._local, "explaining", False):
+            self.analyze(sql, params, many, context["connection"])
+        return result
+
+    def indexed_columns(self, connection):
+        """
+        Return a list of (label, table, column) tuples, with quoted table and
+        column names, for every indexed NaiveDateTimeField column in the
+        installed models.
+        """
+        if connection.vendor not in self._columns:
+            quote = connection.ops.quote_name
+            columns = []
+            for model in apps.get_models():
+                for field in model._meta.local_concrete_fields:
+                    if isinstance(field, NaiveDateTimeField) and _is_indexed(
+                        model, field
+                    ):
+                        columns.append(
+                            (
+                                "%s.%s" % (model._meta.label, field.name),
+                                quote(model._meta.db_table),
+                                quote(field.column),
+                            )
+                        )
+            self._columns[connection.vendor] = columns
+        return self._columns[connection.vendor]
+
+    def analyze(self, sql, params, many, connection):
+        """
+        Check a single statement and record any offenders found in it.
+        """
+        where = _where_clause(sql)
+        if not where:
+            return []
+        found = []
+        for label, table, column in self.indexed_columns(connection):
+            for match in _column_pattern(sql, table, column).finditer(where):
+                function = _outermost_call(where, match.start())
+                if function is not None:
+                    found.append((label, function))
+        if not found:
+            return []
+
+        plan = None
+        is_select = not many and sql.lstrip().upper().startswith("SELECT")
+        if is_select and random.random() < self.sample_rate:
+            plan = self.explain(sql, params, connection)
+
+        stack = self._stack()
+        offenders = [
+            Offender(sql, label, function, _suggestion(function), stack, plan)
+            for label, function in found
+        ]
+        for offender in offenders:
+            if self.log:
+                logger.warning(
+                    "Non-sargable filter on %s: %s\n%s\nSuggestion: %s",
+                    offender.column,
+                    offender.function,
+                    "".join(offender.stack),
+                    offender.suggestion,
+                )
+            if len(self.offenders) < self.max_offenders:
+                self.offenders.append(offender)
+        return offenders
+
+    def explain(self, sql, params, connection):
+        """
+        Return the query plan for ``sql`` as text, or the error raised while
+        trying to get it.
+        """
+        if django.VERSION >= (2, 1):
+            prefix = connection.ops.explain_query_prefix()
+        else:
+            prefix = "EXPLAIN"
+        self._local.explaining = True
+        try:
+            with transaction.atomic(using=connection.alias):
+                with connection.cursor() as cursor:
+                    cursor.execute("%s %s" % (prefix, sql), params)
+                    rows = cursor.fetchall()
+        except DatabaseError as e:
+            return "EXPLAIN failed: %s" % e
+        finally:
+            self._local.explaining = False
+        return "\n".join(" ".join(str(col) for col in row) for row in rows)
+
+    def _stack(self):
+        django_dir = os.path.dirname(django.__file__)
+        this_dir = os.path.dirname(__file__)
+        frames = [
+            frame
+            for frame in traceback.extract_stack()
+            if not frame.filename.startswith((django_dir, this_dir))
+        ]
+        return traceback.format_list(frames[-self.stack_depth:])
+
+    def report(self):
+        """
+        Summarise recorded offenders as text, grouped by column and function.
+        """
+        counts = {}
+        for offender in self.offenders:
+            key = (offender.column, offender.function)
+            counts.setdefault(key, [0, offender])[0] += 1
+        lines = []
+        for (column, function), (count, offender) in sorted(counts.items()):
+            lines.append("%s: %s (%d queries)" % (column, function, count))
+            lines.append("  " + offender.suggestion)
+            if offender.stack:
+                lines.append("  at " + offender.stack[-1].strip().splitlines()[0])
+        return "\n".join(lines)
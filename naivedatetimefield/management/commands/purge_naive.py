@@ -0,0 +1,86 @@
+import datetime
+import time
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from naivedatetimefield.retention import purge
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the rows of a model whose naive timestamp is before a cutoff, "
+        "in small batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("model", help="The model, as app_label.ModelName.")
+        parser.add_argument("field", help="The NaiveDateTimeField to compare.")
+        cutoff = parser.add_mutually_exclusive_group(required=True)
+        cutoff.add_argument(
+            "--before", help="Delete rows before this naive timestamp."
+        )
+        cutoff.add_argument(
+            "--days",
+            type=float,
+            help="Delete rows older than this many days, in the current timezone.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--no-partitions",
+            action="store_false",
+            dest="partitions",
+            help="Don't drop partitions older than the cutoff.",
+        )
+        parser.add_argument("--database", default=None)
+
+    def handle(self, **options):
+        try:
+            model = apps.get_model(options["model"])
+            model._meta.get_field(options["field"])
+        except (LookupError, ValueError, FieldDoesNotExist) as e:
+            raise CommandError(e)
+
+        if options["before"] is not None:
+            cutoff = parse_datetime(options["before"])
+            if cutoff is None or timezone.is_aware(cutoff):
+                raise CommandError("--before must be a naive timestamp.")
+        else:
+            cutoff = timezone.make_naive(timezone.now()) - datetime.timedelta(
+                days=options["days"]
+            )
+
+        def progress(deleted, rate):
+            if options["verbosity"] > 1:
+                self.stdout.write("%d rows deleted (%.0f rows/s)" % (deleted, rate))
+
+        started = time.monotonic()
+        deleted = purge(
+            model._base_manager.db_manager(options["database"]).all(),
+            options["field"],
+            cutoff,
+            batch_size=options["batch_size"],
+            sleep=options["sleep"],
+            progress=progress,
+            partitions=options["partitions"],
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            "Deleted %d rows of %s before %s in %.1fs (%.0f rows/s)."
+            % (
+                deleted,
+                model._meta.label,
+                cutoff,
+                elapsed,
+                deleted / max(elapsed, 1e-6),
+            )
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 23:36
+
+from django.db import migrations, models
+import naivedatetimefield
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeWatermark',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('consumer', models.CharField(max_length=200)),
+                ('model', models.CharField(max_length=200)),
+                ('timestamp', naivedatetimefield.NaiveDateTimeField()),
+                ('last_pk', models.CharField(max_length=200)),
+            ],
+            options={
+                'unique_together': {('consumer', 'model')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import models
+
+from . import NaiveDateTimeField
+
+
+class ChangeWatermark(models.Model):
+    """
+    How far a consumer has read the changes of a model, see
+    ``naivedatetimefield.changes.ChangeExtractor``.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    consumer = models.CharField(max_length=200)
+    model = models.CharField(max_length=200)
+    timestamp = NaiveDateTimeField()
+    last_pk = models.CharField(max_length=200)
+
+    class Meta:
+        unique_together = [("consumer", "model")]
+
+    def __str__(self):
+        return "%s: %s (%s, %s)" % (self.consumer, self.model, self.timestamp, self.last_pk)
@@ -0,0 +1,456 @@
+"""
+Migration operations for moving existing data to NaiveDateTimeField.
+"""
+import contextlib
+import logging
+import time
+
+import pytz
+
+from django.db import DatabaseError, transaction
+from django.db.migrations.operations import AddField, AlterField, RemoveField, RenameField
+from django.db.migrations.operations.base import Operation
+from django.db.models import F, Max, Min, Value
+from django.utils import timezone
+
+from . import AtTimeZone, NaiveDateTimeField
+
+logger = logging.getLogger(__name__)
+
+
+class ConvertToNaiveDateTimeField(Operation):
+    """
+    Convert an aware DateTimeField to a NaiveDateTimeField without rewriting
+    the whole table in a single statement.
+
+    A nullable naive column is added next to the aware one and backfilled in
+    primary key ranges of ``batch_size`` rows, each batch in its own
+    transaction, sleeping ``sleep`` seconds in between. Values are converted
+    to local time using the timezone name stored in ``timezone_field``, or
+    ``tz`` (the default timezone if not given) for every row. The aware
+    column is then dropped and the naive column renamed to take its place.
+
+    Conversion happens in SQL on PostgreSQL, and in Python elsewhere. The
+    backfill only touches rows that haven't been converted yet, so a failed
+    migration can simply be run again. Use it in a migration with
+    ``atomic = False`` so that each batch is committed as it completes.
+
+    Rows written while the migration runs are kept up to date by a trigger
+    (on PostgreSQL), or marked to be converted again (elsewhere), and the
+    columns are swapped while holding a lock that keeps writers out of the
+    table, which is released immediately. The aware column is only dropped
+    once every row has been converted.
+
+    On PostgreSQL a single backfill pass is enough, and a constraint
+    validated beforehand, without blocking writes, proves that every row
+    was converted, so nothing is scanned while the table is locked (and
+    PostgreSQL 12+ uses the constraint to skip the scan for NOT NULL). The
+    index, if any, is created CONCURRENTLY after the lock is released.
+
+    Elsewhere a temporary index on the rows left to convert lets the
+    backfill find the rows written during the previous pass without
+    scanning the table. Passes are repeated until only a batch is left,
+    which is converted while holding the lock. The index, if any, is
+    created while holding the lock; to avoid that, convert with
+    ``db_index=False`` and add the index in a later migration. On MySQL,
+    dropping the aware column (before 8.0.29) and making the naive column
+    NOT NULL rebuild the table, and ``LOCK TABLES`` blocks reads as well as
+    writes until that is done. To keep the latter out of the lock, convert
+    with ``null=True`` and make the field NOT NULL in a later migration,
+    which MySQL runs without blocking writes.
+
+    ``progress`` is called after every batch with the number of rows
+    converted so far, the last primary key processed, the highest primary
+    key to process and the current rate in rows per second.
+
+    The model's primary key must be an integer.
+    """
+
+    reversible = False
+    reduces_to_sql = False
+
+    def __init__(
+        self,
+        model_name,
+        name,
+        field,
+        timezone_field=None,
+        tz=None,
+        batch_size=10000,
+        sleep=0,
+        progress=None,
+    ):
+        if not isinstance(field, NaiveDateTimeField):
+            raise TypeError("field must be a NaiveDateTimeField")
+        self.model_name = model_name
+        self.name = name
+        self.field = field
+        self.timezone_field = timezone_field
+        self.tz = tz
+        self.batch_size = batch_size
+        self.sleep = sleep
+        self.progress = progress
+
+    @property
+    def temp_name(self):
+        return "%s_naive" % self.name
+
+    def describe(self):
+        return "Convert %s to NaiveDateTimeField on %s in batches" % (
+            self.name,
+            self.model_name,
+        )
+
+    def state_forwards(self, app_label, state):
+        AlterField(self.model_name, self.name, self.field).state_forwards(
+            app_label, state
+        )
+
+    def _temp_field(self):
+        return self._clone_field(
+            null=True, db_index=False, unique=False, primary_key=False
+        )
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        connection = schema_editor.connection
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(connection.alias, to_model):
+            return
+
+        add_field = AddField(self.model_name, self.temp_name, self._temp_field())
+        state = from_state.clone()
+        add_field.state_forwards(app_label, state)
+        model = state.apps.get_model(app_label, self.model_name)
+        with connection.cursor() as cursor:
+            columns = {
+                info.name
+                for info in connection.introspection.get_table_description(
+                    cursor, model._meta.db_table
+                )
+            }
+        if model._meta.get_field(self.temp_name).column not in columns:
+            add_field.database_forwards(app_label, schema_editor, from_state, state)
+
+        self._create_trigger(model, schema_editor)
+        check_name = None
+        if connection.vendor == "postgresql":
+            # The trigger converts every row written once it exists.
+            self.backfill(model, connection)
+            check_name = self._add_converted_check(model, schema_editor)
+        else:
+            self._create_pending_index(model, schema_editor)
+            # Each pass converts the rows written during the previous one,
+            # until what is left is small enough to convert while holding
+            # the lock.
+            while self.backfill(model, connection) >= self.batch_size:
+                pass
+
+        field = self.field
+        concurrent_index = connection.vendor == "postgresql" and all(
+            [field.db_index, not field.unique, not connection.in_atomic_block]
+        )
+        if concurrent_index:
+            field = self._clone_field(db_index=False)
+
+        with self._lock(model, connection):
+            # On SQLite, dropping the trigger is the first write and takes
+            # the database lock.
+            self._drop_trigger(model, schema_editor)
+            if check_name is None:
+                self.backfill(model, connection)
+                if self._pending(model, connection.alias).exists():
+                    raise DatabaseError(
+                        "Rows of %s were written without converting %s, the "
+                        "original column was kept." % (model._meta.label, self.name)
+                    )
+                self._drop_pending_index(model, schema_editor)
+            operations = [
+                RemoveField(self.model_name, self.name),
+                RenameField(self.model_name, self.temp_name, self.name),
+                AlterField(self.model_name, self.name, field),
+            ]
+            for operation in operations:
+                new_state = state.clone()
+                operation.state_forwards(app_label, new_state)
+                operation.database_forwards(app_label, schema_editor, state, new_state)
+                state = new_state
+            if check_name is not None:
+                # Gone already if it referred to the aware column
+                schema_editor.execute(
+                    "ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s"
+                    % (
+                        schema_editor.quote_name(model._meta.db_table),
+                        schema_editor.quote_name(check_name),
+                    )
+                )
+
+        if concurrent_index:
+            model = state.apps.get_model(app_label, self.model_name)
+            self._create_index_concurrently(model, schema_editor)
+
+    def _clone_field(self, **changes):
+        name, path, args, kwargs = self.field.deconstruct()
+        kwargs.update(changes)
+        return self.field.__class__(*args, **kwargs)
+
+    def _trigger_name(self, model, schema_editor):
+        return schema_editor._create_index_name(
+            model._meta.db_table, [self.name], suffix="_naive_sync"
+        )
+
+    def _create_trigger(self, model, schema_editor):
+        """
+        Keep rows written during the backfill from being left behind.
+
+        On PostgreSQL a trigger converts the timestamp of every inserted or
+        updated row. Elsewhere a trigger clears the naive value of rows
+        whose timestamp (or timezone) changes after being converted, so
+        that they are converted again; inserted rows start out unconverted.
+        """
+        opts = model._meta
+        quote_name = schema_editor.quote_name
+        name = quote_name(self._trigger_name(model, schema_editor))
+        table = quote_name(opts.db_table)
+        source = quote_name(opts.get_field(self.name).column)
+        temp = quote_name(opts.get_field(self.temp_name).column)
+        tz_column = None
+        if self.timezone_field:
+            tz_column = quote_name(opts.get_field(self.timezone_field).column)
+        vendor = schema_editor.connection.vendor
+
+        self._drop_trigger(model, schema_editor)
+        if vendor == "postgresql":
+            if tz_column:
+                tz = "NEW.%s" % tz_column
+            else:
+                tz = schema_editor.quote_value(
+                    self.tz or timezone.get_default_timezone_name()
+                )
+            schema_editor.execute(
+                "CREATE OR REPLACE FUNCTION %s() RETURNS trigger AS $$ BEGIN "
+                "NEW.%s := NEW.%s AT TIME ZONE %s; RETURN NEW; END $$ "
+                "LANGUAGE plpgsql" % (name, temp, source, tz)
+            )
+            schema_editor.execute(
+                "CREATE TRIGGER %s BEFORE INSERT OR UPDATE ON %s FOR EACH ROW "
+                "EXECUTE PROCEDURE %s()" % (name, table, name)
+            )
+        elif vendor == "mysql":
+            unchanged = "NEW.%s <=> OLD.%s" % (source, source)
+            if tz_column:
+                unchanged += " AND NEW.%s <=> OLD.%s" % (tz_column, tz_column)
+            schema_editor.execute(
+                "CREATE TRIGGER %s BEFORE UPDATE ON %s FOR EACH ROW "
+                "SET NEW.%s = IF(%s, NEW.%s, NULL)"
+                % (name, table, temp, unchanged, temp)
+            )
+        elif vendor == "sqlite":
+            columns = [source]
+            changed = "NEW.%s IS NOT OLD.%s" % (source, source)
+            if tz_column:
+                columns.append(tz_column)
+                changed += " OR NEW.%s IS NOT OLD.%s" % (tz_column, tz_column)
+            pk = quote_name(opts.pk.column)
+            schema_editor.execute(
+                "CREATE TRIGGER %s AFTER UPDATE OF %s ON %s FOR EACH ROW "
+                "WHEN %s BEGIN UPDATE %s SET %s = NULL WHERE %s = NEW.%s; END"
+                % (name, ", ".join(columns), table, changed, table, temp, pk, pk)
+            )
+
+    def _drop_trigger(self, model, schema_editor):
+        quote_name = schema_editor.quote_name
+        name = quote_name(self._trigger_name(model, schema_editor))
+        if schema_editor.connection.vendor == "postgresql":
+            schema_editor.execute(
+                "DROP TRIGGER IF EXISTS %s ON %s"
+                % (name, quote_name(model._meta.db_table))
+            )
+            schema_editor.execute("DROP FUNCTION IF EXISTS %s()" % name)
+        else:
+            schema_editor.execute("DROP TRIGGER IF EXISTS %s" % name)
+
+    def _add_converted_check(self, model, schema_editor):
+        """
+        Prove that every row has been converted without blocking writes,
+        and keep it that way until the columns are swapped, so that nothing
+        needs to be checked while the table is locked. For a NOT NULL field
+        the constraint is a plain NOT NULL check, which PostgreSQL 12+ uses
+        to make the column NOT NULL without scanning the table. Fails,
+        leaving the original column in place, if some rows couldn't be
+        converted.
+        """
+        opts = model._meta
+        quote_name = schema_editor.quote_name
+        name = schema_editor._create_index_name(
+            opts.db_table, [self.temp_name], suffix="_notnull"
+        )
+        table = quote_name(opts.db_table)
+        check = "%s IS NOT NULL" % quote_name(opts.get_field(self.temp_name).column)
+        if self.field.null:
+            check += " OR %s IS NULL" % quote_name(opts.get_field(self.name).column)
+        schema_editor.execute(
+            "ALTER TABLE %s DROP CONSTRAINT IF EXISTS %s" % (table, quote_name(name))
+        )
+        schema_editor.execute(
+            "ALTER TABLE %s ADD CONSTRAINT %s CHECK (%s) NOT VALID"
+            % (table, quote_name(name), check)
+        )
+        schema_editor.execute(
+            "ALTER TABLE %s VALIDATE CONSTRAINT %s" % (table, quote_name(name))
+        )
+        return name
+
+    def _pending_index_name(self, model, schema_editor):
+        return schema_editor._create_index_name(
+            model._meta.db_table, [self.temp_name], suffix="_pending"
+        )
+
+    def _create_pending_index(self, model, schema_editor):
+        """
+        Index the rows left to convert, so that finding the rows written
+        during a pass doesn't scan the table, in particular while it is
+        locked. SQLite supports partial indexes; MySQL looks up NULLs in a
+        regular index.
+        """
+        opts = model._meta
+        connection = schema_editor.connection
+        name = self._pending_index_name(model, schema_editor)
+        with connection.cursor() as cursor:
+            if name in connection.introspection.get_constraints(
+                cursor, opts.db_table
+            ):
+                return
+        quote_name = schema_editor.quote_name
+        table = quote_name(opts.db_table)
+        source = quote_name(opts.get_field(self.name).column)
+        temp = quote_name(opts.get_field(self.temp_name).column)
+        if connection.vendor == "sqlite":
+            schema_editor.execute(
+                "CREATE INDEX %s ON %s (%s) WHERE %s IS NULL AND %s IS NOT NULL"
+                % (quote_name(name), table, quote_name(opts.pk.column), temp, source)
+            )
+        elif connection.vendor == "mysql":
+            schema_editor.execute(
+                "CREATE INDEX %s ON %s (%s, %s)"
+                % (quote_name(name), table, temp, source)
+            )
+
+    def _drop_pending_index(self, model, schema_editor):
+        if schema_editor.connection.vendor in ("sqlite", "mysql"):
+            schema_editor.execute(
+                schema_editor._delete_index_sql(
+                    model, self._pending_index_name(model, schema_editor)
+                )
+            )
+
+    def _create_index_concurrently(self, model, schema_editor):
+        opts = model._meta
+        column = opts.get_field(self.name).column
+        schema_editor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s)"
+            % (
+                schema_editor.quote_name(
+                    schema_editor._create_index_name(opts.db_table, [column])
+                ),
+                schema_editor.quote_name(opts.db_table),
+                schema_editor.quote_name(column),
+            )
+        )
+
+    @contextlib.contextmanager
+    def _lock(self, model, connection):
+        """
+        Keep other writers out of the table while the last rows are
+        converted and the columns are swapped.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        if connection.vendor == "mysql":
+            # DDL commits implicitly on MySQL, so a transaction can't hold
+            # the lock.
+            with connection.cursor() as cursor:
+                cursor.execute("LOCK TABLES %s WRITE" % table)
+            try:
+                yield
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute("UNLOCK TABLES")
+        else:
+            with transaction.atomic(using=connection.alias):
+                if connection.vendor == "postgresql":
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE" % table
+                        )
+                yield
+
+    def _convert_sql(self, batch):
+        if self.timezone_field:
+            tz = F(self.timezone_field)
+        else:
+            tz = Value(self.tz or timezone.get_default_timezone_name())
+        return batch.update(**{self.temp_name: AtTimeZone(self.name, tz)})
+
+    def _convert_python(self, model, batch, using):
+        fields = ["pk", self.name]
+        if self.timezone_field:
+            fields.append(self.timezone_field)
+        default_tz = pytz.timezone(self.tz or timezone.get_default_timezone_name())
+        objs = []
+        for row in batch.values_list(*fields):
+            value = row[1]
+            if timezone.is_naive(value):
+                # USE_TZ = False, values are in the default timezone
+                value = timezone.make_aware(value)
+            tz = pytz.timezone(row[2]) if self.timezone_field else default_tz
+            objs.append(
+                model(pk=row[0], **{self.temp_name: timezone.make_naive(value, tz)})
+            )
+        model._base_manager.db_manager(using).bulk_update(objs, [self.temp_name])
+        return len(objs)
+
+    def _pending(self, model, using):
+        return model._base_manager.db_manager(using).filter(
+            **{self.temp_name + "__isnull": True, self.name + "__isnull": False}
+        )
+
+    def backfill(self, model, connection):
+        """
+        Fill the temporary naive column of every row that hasn't been
+        converted yet. Returns the number of rows converted.
+        """
+        using = connection.alias
+        pending = self._pending(model, using)
+        bounds = pending.aggregate(first=Min("pk"), last=Max("pk"))
+        if bounds["first"] is None:
+            return 0
+
+        converted = 0
+        started = time.monotonic()
+        start = bounds["first"]
+        while start <= bounds["last"]:
+            end = start + self.batch_size
+            with transaction.atomic(using=using):
+                batch = pending.filter(pk__gte=start, pk__lt=end)
+                if connection.vendor == "postgresql":
+                    converted += self._convert_sql(batch)
+                else:
+                    converted += self._convert_python(model, batch, using)
+
+            rate = converted / max(time.monotonic() - started, 1e-6)
+            last_pk = min(end - 1, bounds["last"])
+            logger.info(
+                "Converted %d rows of %s.%s (pk %d of %d, %.0f rows/s)",
+                converted,
+                model._meta.label,
+                self.name,
+                last_pk,
+                bounds["last"],
+                rate,
+            )
+            if self.progress is not None:
+                self.progress(converted, last_pk, bounds["last"], rate)
+
+            start = end
+            if self.sleep and start <= bounds["last"]:
+                time.sleep(self.sleep)
+        return converted
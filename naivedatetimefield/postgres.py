@@ -0,0 +1,103 @@
+"""
+PostgreSQL range support for naive timestamps.
+
+Importing this module requires psycopg2, like django.contrib.postgres.
+"""
+import datetime
+
+import django
+from psycopg2.extras import DateTimeRange
+
+from django.contrib.postgres import forms
+from django.contrib.postgres.fields import RangeField
+from django.db.models import Func, Value
+
+from . import NaiveDateTimeField
+
+if django.VERSION >= (3, 2):
+    from django.db.models.lookups import PostgresOperatorLookup
+else:
+    from django.contrib.postgres.lookups import PostgresSimpleLookup
+
+    class PostgresOperatorLookup(PostgresSimpleLookup):
+        """
+        Before Django 3.2, operator lookups name their operator ``operator``.
+        """
+
+        @property
+        def operator(self):
+            return self.postgres_operator
+
+
+class NaiveDateTimeRangeField(RangeField):
+    """
+    A range of naive timestamps, stored as ``tsrange``.
+
+    The usual range lookups (``overlap``, ``contains``, ``contained_by``,
+    ``adjacent_to`` ...) are available, and the field can be indexed with
+    ``django.contrib.postgres.indexes.GistIndex`` or used in an
+    ``ExclusionConstraint`` to forbid overlapping ranges.
+    """
+
+    base_field = NaiveDateTimeField
+    range_type = DateTimeRange
+    form_field = forms.DateTimeRangeField
+
+    def db_type(self, connection):
+        return "tsrange"
+
+
+@NaiveDateTimeRangeField.register_lookup
+class NaiveDateTimeRangeContains(PostgresOperatorLookup):
+    """
+    Containment of a single naive timestamp, which Django would otherwise
+    send and cast as an aware timestamp.
+    """
+
+    lookup_name = "contains"
+    postgres_operator = "@>"
+
+    def process_rhs(self, compiler, connection):
+        if isinstance(self.rhs, datetime.datetime):
+            value = Value(self.rhs, output_field=NaiveDateTimeField())
+            self.rhs = value.resolve_expression(compiler.query)
+        sql, params = super(NaiveDateTimeRangeContains, self).process_rhs(
+            compiler, connection
+        )
+        output_field = getattr(self.rhs, "_output_field_or_none", None)
+        if isinstance(output_field, NaiveDateTimeField):
+            sql = "%s::timestamp" % sql
+        return sql, params
+
+
+@NaiveDateTimeField.register_lookup
+class NaiveRangeContainedBy(PostgresOperatorLookup):
+    lookup_name = "contained_by"
+    postgres_operator = "<@"
+
+    def process_rhs(self, compiler, connection):
+        sql, params = super(NaiveRangeContainedBy, self).process_rhs(
+            compiler, connection
+        )
+        return "%s::tsrange" % sql, params
+
+    def get_prep_lookup(self):
+        return NaiveDateTimeRangeField().get_prep_value(self.rhs)
+
+
+class TsRange(Func):
+    """
+    Build a tsrange from two naive timestamp expressions, e.g. to add an
+    exclusion constraint over a pair of start and end columns:
+
+        ExclusionConstraint(
+            name="exclude_overlapping_bookings",
+            expressions=[
+                (TsRange("start", "end", RangeBoundary()), RangeOperators.OVERLAPS),
+                ("room", RangeOperators.EQUAL),
+            ],
+        )
+    """
+
+    function = "TSRANGE"
+    output_field = NaiveDateTimeRangeField()
@@ -0,0 +1,72 @@
+"""
+Range queries over a pair of naive start and end columns, for databases
+without a native range type.
+"""
+from django.db.models import Index, Q
+
+
+class NaiveDateTimeRangePair(object):
+    """
+    Treat two NaiveDateTimeFields as a half-open ``[start, end)`` range.
+
+    Overlap and containment filters on a pair of columns normally can only
+    use an index on one bound, and scan every row that started before the
+    end of the searched range. When the longest range stored is known,
+    ``max_duration`` adds a lower bound on the start column so that the
+    index on ``(start, end)`` returned by ``index()`` is only scanned over a
+    window of ``max_duration`` before the searched range. Rows longer than
+    ``max_duration`` are then missed, so it must be enforced on save.
+
+        during = NaiveDateTimeRangePair("start", "end", timedelta(days=14))
+
+        class Booking(models.Model):
+            start = NaiveDateTimeField()
+            end = NaiveDateTimeField()
+
+            class Meta:
+                indexes = [during.index("booking_during_idx")]
+
+        Booking.objects.filter(during.overlap(lower, upper))
+    """
+
+    def __init__(self, start, end, max_duration=None):
+        self.start = start
+        self.end = end
+        self.max_duration = max_duration
+
+    def index(self, name):
+        return Index(fields=[self.start, self.end], name=name)
+
+    def _bounded(self, q, lower):
+        if self.max_duration is not None:
+            q &= Q(**{self.start + "__gt": lower - self.max_duration})
+        return q
+
+    def overlap(self, lower, upper):
+        """
+        Rows whose range shares at least one instant with ``[lower, upper)``.
+        """
+        return self._bounded(
+            Q(**{self.start + "__lt": upper, self.end + "__gt": lower}), lower
+        )
+
+    def contains(self, value):
+        """
+        Rows whose range contains the timestamp ``value``.
+        """
+        return self._bounded(
+            Q(**{self.start + "__lte": value, self.end + "__gt": value}), value
+        )
+
+    def contained_by(self, lower, upper):
+        """
+        Rows whose range lies entirely within ``[lower, upper)``.
+        """
+        return Q(**{self.start + "__gte": lower, self.end + "__lte": upper})
+
+    def adjacent(self, lower, upper):
+        """
+        Rows whose range ends where ``[lower, upper)`` starts, or starts
+        where it ends.
+        """
+        return Q(**{self.end: lower}) | Q(**{self.start: upper})
@@ -0,0 +1,171 @@
+"""
+Deleting rows older than a naive cutoff without long locks.
+"""
+import logging
+import re
+import time
+
+from django.db import OperationalError, connections, router, transaction
+from django.db.models import Q
+from django.db.models.deletion import Collector
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+_PARTITION_UPPER_BOUND = re.compile(r"\bTO \('([^']*)'\)")
+
+
+def _partitions(connection, table, column):
+    """
+    Return the (name, upper bound, estimated rows) of the partitions of
+    ``table`` if it is range partitioned on ``column`` alone, else [].
+    """
+    if connection.vendor != "postgresql":
+        return []
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_get_partkeydef(c.oid) FROM pg_class c "
+            "WHERE c.oid = to_regclass(%s) AND c.relkind = 'p'",
+            [quote_name(table)],
+        )
+        row = cursor.fetchone()
+        if row is None or row[0] not in (
+            "RANGE (%s)" % column,
+            "RANGE (%s)" % quote_name(column),
+        ):
+            return []
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [quote_name(table)],
+        )
+        partitions = []
+        for name, bound, rows in cursor.fetchall():
+            match = _PARTITION_UPPER_BOUND.search(bound)
+            upper = parse_datetime(match.group(1)) if match else None
+            if upper is not None:
+                partitions.append((name, upper, max(int(rows), 0)))
+        return partitions
+
+
+def drop_partitions(model, field, cutoff, using=None, lock_timeout="5s"):
+    """
+    Drop the partitions of ``model``'s table that only hold rows whose
+    ``field`` is before ``cutoff``, when the table is a PostgreSQL table
+    range partitioned on that field. Returns the number of rows dropped,
+    as estimated by the planner statistics.
+
+    Dropping a partition locks the whole table. On PostgreSQL 14+, outside
+    of a transaction, partitions are first detached CONCURRENTLY, which
+    doesn't block queries on the table. Otherwise the partition is dropped
+    directly, giving up after ``lock_timeout`` rather than waiting behind
+    long queries while blocking every new one. Partitions that couldn't be
+    dropped are left for the batched deletes of ``purge()``.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    column = model._meta.get_field(field).column
+    concurrently = connection.vendor == "postgresql" and (
+        connection.pg_version >= 140000 and not connection.in_atomic_block
+    )
+    dropped = 0
+    for name, upper, rows in _partitions(connection, model._meta.db_table, column):
+        if upper > cutoff:
+            continue
+        partition = quote_name(name)
+        if concurrently:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "ALTER TABLE %s DETACH PARTITION %s CONCURRENTLY"
+                    % (table, partition)
+                )
+                cursor.execute("DROP TABLE %s" % partition)
+        else:
+            try:
+                with transaction.atomic(using=using):
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            "SELECT set_config('lock_timeout', %s, true)",
+                            [lock_timeout],
+                        )
+                        cursor.execute("DROP TABLE %s" % partition)
+            except OperationalError:
+                logger.warning("Timed out locking %s to drop partition %s", table, name)
+                continue
+        logger.info("Dropped partition %s (about %d rows)", name, rows)
+        dropped += rows
+    return dropped
+
+
+def purge(queryset, field, cutoff, batch_size=1000, sleep=0, progress=None, partitions=True):
+    """
+    Delete the rows of ``queryset`` whose naive ``field`` is before
+    ``cutoff``, and return how many were deleted.
+
+    Rows are deleted in batches of ``batch_size``, each in its own
+    transaction, sleeping ``sleep`` seconds in between. Batches are taken
+    in ``(field, pk)`` order, starting after the last row of the previous
+    batch, so that an index on ``(field, pk)`` (or on ``field``) is read
+    once from start to end instead of skipping over the rows already
+    deleted. When deleting the model has no cascades and sends no signals,
+    batches are deleted with a single query without loading any objects;
+    otherwise they go through ``QuerySet.delete()``.
+
+    With ``partitions``, partitions that are entirely older than the
+    cutoff are dropped first when ``queryset`` is unfiltered (see
+    ``drop_partitions()``).
+
+    ``progress`` is called after every batch with the number of rows
+    deleted so far and the current rate in rows per second.
+    """
+    model = queryset.model
+    using = queryset.db
+    started = time.monotonic()
+    deleted = 0
+    if partitions and not queryset.query.where:
+        deleted = drop_partitions(model, field, cutoff, using)
+
+    pending = queryset.filter(**{field + "__lt": cutoff}).order_by(field, "pk")
+    fast = Collector(using=using).can_fast_delete(pending)
+    last = None
+    while True:
+        with transaction.atomic(using=using):
+            batch = pending
+            if last is not None:
+                # Planners can't seek an index with the OR alone, the
+                # redundant field >= last gives the range scan its start.
+                batch = batch.filter(
+                    Q(**{field + "__gt": last[0]}) | Q(**{field: last[0], "pk__gt": last[1]}),
+                    **{field + "__gte": last[0]}
+                )
+            keys = list(batch.values_list(field, "pk")[:batch_size])
+            if not keys:
+                break
+            rows = model._base_manager.using(using).filter(
+                pk__in=[pk for value, pk in keys]
+            )
+            if fast:
+                deleted += rows._raw_delete(using)
+            else:
+                deleted += rows.delete()[1].get(model._meta.label, 0)
+        last = keys[-1]
+
+        rate = deleted / max(time.monotonic() - started, 1e-6)
+        logger.info(
+            "Deleted %d rows of %s older than %s (%.0f rows/s)",
+            deleted,
+            model._meta.label,
+            cutoff,
+            rate,
+        )
+        if progress is not None:
+            progress(deleted, rate)
+        if len(keys) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+    return deleted
@@ -0,0 +1,159 @@
+"""
+Async streaming of querysets containing naive timestamps.
+
+    async for obj in astream(Event.objects.filter(...), chunk_size=5000):
+        ...
+
+Rows are fetched in chunks with a server-side cursor where the backend
+supports one, in the thread Django uses for synchronous database access.
+Each chunk is converted column by column, using
+``NaiveDateTimeField.from_db_values`` for naive columns, instead of passing
+every row through the converters one value at a time. Chunks of at least
+``offload_threshold`` rows are converted in ``executor`` (the event loop's
+default thread pool if None) so that long exports don't block the loop.
+
+Importing this module requires asgiref, a dependency of Django 3.0 and later.
+"""
+import asyncio
+import operator
+
+from asgiref.sync import sync_to_async
+
+from django.db.models.expressions import Col
+from django.db.models.query import ModelIterable, get_related_populators
+
+from . import NaiveDateTimeField
+
+
+def _is_naive(expression):
+    return isinstance(expression.output_field, NaiveDateTimeField)
+
+
+class ChunkConverter(object):
+    """
+    Turn chunks of raw rows from a compiled model query into instances.
+    """
+
+    def __init__(self, compiler, db, known_related_objects=None):
+        self.connection = compiler.connection
+        self.db = db
+        select = compiler.select
+        klass_info = compiler.klass_info
+        fields = [s[0] for s in select[0:compiler.col_count]]
+        self.converters = compiler.get_converters(fields)
+        self.naive_positions = {
+            pos
+            for pos, (convs, expression) in self.converters.items()
+            if isinstance(expression, Col) and _is_naive(expression)
+        }
+        # Interned values are shared between the chunks of the query
+        self.caches = {pos: {} for pos in self.naive_positions}
+        self.model_cls = klass_info["model"]
+        select_fields = klass_info["select_fields"]
+        self.model_fields_start = select_fields[0]
+        self.model_fields_end = select_fields[-1] + 1
+        self.init_list = [
+            f[0].target.attname
+            for f in select[self.model_fields_start:self.model_fields_end]
+        ]
+        self.related_populators = get_related_populators(klass_info, select, db)
+        self.annotation_col_map = compiler.annotation_col_map
+        # Objects already known to be related, as with a related manager's
+        # queryset, keyed by the value of the foreign key (see ModelIterable)
+        self.known_related_objects = [
+            (
+                field,
+                related_objs,
+                operator.attrgetter(
+                    *[
+                        field.attname
+                        if from_field == "self"
+                        else self.model_cls._meta.get_field(from_field).attname
+                        for from_field in field.from_fields
+                    ]
+                ),
+            )
+            for field, related_objs in (known_related_objects or {}).items()
+        ]
+
+    def convert_rows(self, rows):
+        rows = [list(row) for row in rows]
+        connection = self.connection
+        for pos, (convs, expression) in self.converters.items():
+            column = [row[pos] for row in rows]
+            if pos in self.naive_positions:
+                column = expression.output_field.from_db_values(
+                    column, connection, self.caches[pos]
+                )
+            else:
+                for converter in convs:
+                    column = [
+                        converter(value, expression, connection) for value in column
+                    ]
+            for row, value in zip(rows, column):
+                row[pos] = value
+        return rows
+
+    def __call__(self, rows):
+        objs = []
+        start, end = self.model_fields_start, self.model_fields_end
+        for row in self.convert_rows(rows):
+            obj = self.model_cls.from_db(self.db, self.init_list, row[start:end])
+            for rel_populator in self.related_populators:
+                rel_populator.populate(row, obj)
+            if self.annotation_col_map:
+                for attr_name, col_pos in self.annotation_col_map.items():
+                    setattr(obj, attr_name, row[col_pos])
+            for field, related_objs, get_related_id in self.known_related_objects:
+                if field.is_cached(obj):
+                    continue
+                related_obj = related_objs.get(get_related_id(obj))
+                if related_obj is not None:
+                    setattr(obj, field.name, related_obj)
+            objs.append(obj)
+        return objs
+
+
+def _execute(queryset, chunk_size):
+    db = queryset.db
+    compiler = queryset.query.get_compiler(using=db)
+    results = compiler.execute_sql(chunked_fetch=True, chunk_size=chunk_size)
+    return (
+        iter(results),
+        ChunkConverter(compiler, db, queryset._known_related_objects),
+    )
+
+
+def _close(results):
+    close = getattr(results, "close", None)
+    if close is not None:
+        close()
+
+
+async def astream(queryset, chunk_size=2000, offload_threshold=None, executor=None):
+    """
+    Asynchronously iterate over the model instances of ``queryset``.
+    """
+    if queryset._iterable_class is not ModelIterable:
+        raise TypeError("astream() only supports querysets of model instances.")
+    if queryset._prefetch_related_lookups:
+        raise TypeError("astream() doesn't support prefetch_related().")
+    fetch_next = sync_to_async(next, thread_sensitive=True)
+    results, convert = await sync_to_async(_execute, thread_sensitive=True)(
+        queryset, chunk_size
+    )
+    # get_running_loop() was added in Python 3.7
+    loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)()
+    try:
+        while True:
+            rows = await fetch_next(results, None)
+            if rows is None:
+                break
+            if offload_threshold is not None and len(rows) >= offload_threshold:
+                objs = await loop.run_in_executor(executor, convert, rows)
+            else:
+                objs = convert(rows)
+            for obj in objs:
+                yield obj
+    finally:
+        await sync_to_async(_close, thread_sensitive=True)(results)
@@ -0,0 +1,423 @@
+"""
+Hot/cold tiering of rows by a NaiveDateTimeField.
+
+Rows older than ``age`` are moved from the ``hot`` database to the
+``archive`` database by ``NaiveTieringPolicy.move_to_archive()``, run
+periodically (e.g. daily, in which case ``grace`` should be at least a day).
+Querysets from a ``TieredManager`` only query the databases that can hold
+rows in the range of the naive field they are filtered on, and merge the
+results in order when the range spans both.
+
+    policy = NaiveTieringPolicy("created", hot="default", archive="archive")
+
+    class Event(models.Model):
+        created = NaiveDateTimeField()
+
+        objects = TieredManager(policy)
+
+    DATABASE_ROUTERS = ["naivedatetimefield.tiering.NaiveTieringRouter"]
+"""
+import datetime
+import heapq
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import NotSupportedError, transaction
+from django.db.models import F, Manager, QuerySet
+from django.db.models.expressions import Col
+from django.db.models.lookups import Lookup
+from django.db.models.query import (
+    FlatValuesListIterable,
+    ModelIterable,
+    ValuesIterable,
+)
+from django.db.models.sql.where import AND, WhereNode
+from django.utils import timezone
+
+
+class NaiveTieringPolicy(object):
+    """
+    Where the rows of a model live, based on the age of their ``field``.
+
+    The archive holds rows older than the cutoff (now minus ``age``). The
+    hot database holds newer rows, and older ones that haven't been moved
+    yet, up to ``grace`` before the cutoff.
+    """
+
+    def __init__(
+        self,
+        field,
+        hot="default",
+        archive="archive",
+        age=datetime.timedelta(days=30),
+        grace=datetime.timedelta(days=1),
+    ):
+        self.field = field
+        self.hot = hot
+        self.archive = archive
+        self.age = age
+        self.grace = grace
+
+    def cutoff(self):
+        return timezone.make_naive(timezone.now()) - self.age
+
+    def tiers(self, lower=None, upper=None):
+        """
+        Return the aliases of the databases that can hold rows whose field
+        value is between ``lower`` and ``upper`` (inclusive, None meaning
+        unbounded), archive first.
+        """
+        cutoff = self.cutoff()
+        tiers = []
+        if lower is None or lower < cutoff:
+            tiers.append(self.archive)
+        if upper is None or upper >= cutoff - self.grace:
+            tiers.append(self.hot)
+        return tiers
+
+    def move_to_archive(self, model, batch_size=1000):
+        """
+        Move rows older than the cutoff from the hot database to the
+        archive, in batches. Returns the number of rows moved.
+        """
+        manager = model._base_manager
+        cutoff = self.cutoff()
+        moved = 0
+        while True:
+            with transaction.atomic(using=self.hot):
+                with transaction.atomic(using=self.archive):
+                    batch = list(
+                        manager.using(self.hot)
+                        .filter(**{self.field + "__lt": cutoff})
+                        .order_by(self.field, "pk")[:batch_size]
+                    )
+                    if not batch:
+                        return moved
+                    # Rows may already be there if a previous run failed
+                    # between the two commits.
+                    manager.using(self.archive).bulk_create(
+                        batch, ignore_conflicts=True
+                    )
+                manager.using(self.hot).filter(
+                    pk__in=[obj.pk for obj in batch]
+                ).delete()
+            moved += len(batch)
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return None
+
+
+def _field_bounds(where, field):
+    """
+    Return the (lower, upper) bounds that the AND-ed conditions of
+    ``where`` put on ``field``, None meaning unbounded.
+    """
+    lower = upper = None
+    if where.connector != AND or where.negated:
+        return lower, upper
+    for child in where.children:
+        if isinstance(child, WhereNode):
+            bounds = _field_bounds(child, field)
+        elif isinstance(child, Lookup) and _is_column(child.lhs, field):
+            bounds = _lookup_bounds(child)
+        else:
+            continue
+        if bounds[0] is not None and (lower is None or bounds[0] > lower):
+            lower = bounds[0]
+        if bounds[1] is not None and (upper is None or bounds[1] < upper):
+            upper = bounds[1]
+    return lower, upper
+
+
+def _is_column(expression, field):
+    return isinstance(expression, Col) and expression.target == field
+
+
+def _lookup_bounds(lookup):
+    if lookup.lookup_name == "range":
+        return tuple(_as_datetime(value) for value in lookup.rhs)
+    value = _as_datetime(lookup.rhs)
+    if lookup.lookup_name == "exact":
+        return value, value
+    if lookup.lookup_name in ("gt", "gte"):
+        return value, None
+    if lookup.lookup_name in ("lt", "lte"):
+        return None, value
+    return None, None
+
+
+class _Reversed(object):
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+class TieredQuerySet(QuerySet):
+    """
+    A QuerySet that reads from the tiers covering the range of the policy's
+    field it is filtered on. Use ``using()`` to query a single database.
+    """
+
+    policy = None
+
+    def _clone(self):
+        clone = super(TieredQuerySet, self)._clone()
+        clone.policy = self.policy
+        return clone
+
+    def tiers(self):
+        if self._db is not None or self.policy is None:
+            return [self.db]
+        field = self.model._meta.get_field(self.policy.field)
+        return self.policy.tiers(*_field_bounds(self.query.where, field))
+
+    def _attname(self, name):
+        if name == "pk" or name in self.query.annotation_select:
+            return name
+        try:
+            return self.model._meta.get_field(name).attname
+        except FieldDoesNotExist:
+            raise NotSupportedError(
+                "Only ordering by fields of the model is supported across tiers."
+            )
+
+    def _ordering(self):
+        """
+        Return the query's ordering as (name, descending) pairs, before
+        reverse() is applied.
+        """
+        query = self.query
+        ordering = query.order_by or (
+            query.default_ordering and self.model._meta.ordering
+        )
+        names = []
+        for item in ordering or ():
+            if not isinstance(item, str) or item == "?":
+                raise NotSupportedError(
+                    "Only ordering by field names is supported across tiers."
+                )
+            names.append((item.lstrip("-"), item.startswith("-")))
+        return names
+
+    def _sort_key(self):
+        """
+        Return a function giving the sort key of a result, from the query's
+        ordering, or None if the query isn't ordered.
+        """
+        query = self.query
+        # reverse() (and so last()) flips every term of the ordering
+        reverse = not query.standard_ordering
+        names = [
+            (name, descending != reverse) for name, descending in self._ordering()
+        ]
+        if not names:
+            return None
+
+        if self._iterable_class is ModelIterable:
+            getters = [_attr_getter(self._attname(name)) for name, _ in names]
+        else:
+            # Rows can only be ordered by the selected columns, which must
+            # lead the ordering for the merge to be correct.
+            columns = list(query.extra_select)
+            columns.extend(query.values_select)
+            columns.extend(query.annotation_select)
+            getters = []
+            for name, _ in names:
+                if name not in columns:
+                    break
+                if self._iterable_class is ValuesIterable:
+                    getters.append(_item_getter(name))
+                elif self._iterable_class is FlatValuesListIterable:
+                    getters.append(_identity)
+                else:
+                    getters.append(_item_getter(columns.index(name)))
+            if not getters:
+                return None
+
+        def key(result):
+            values = []
+            for getter, (name, descending) in zip(getters, names):
+                value = getter(result)
+                # NULLs sort last, as each tier is asked to (see
+                # _tier_iterators()).
+                value = (value is None, value)
+                values.append(_Reversed(value) if descending else value)
+            return values
+
+        return key
+
+    def _tier_iterators(self, tiers, chunk_size=2000):
+        query = self.query
+        low, high = query.low_mark, query.high_mark
+        names = self._ordering()
+        for alias in tiers:
+            clone = self.using(alias)
+            if low or high is not None:
+                clone.query.clear_limits()
+                if high is not None:
+                    clone.query.set_limits(0, high)
+            if names:
+                # Databases disagree on where NULLs go, so place them
+                # explicitly, in the order of the merge key. The expressions
+                # are created for each query, as Django before 3.0 reverses
+                # them in place.
+                clone.query.clear_ordering(force_empty=False)
+                clone.query.add_ordering(*[
+                    F(name).desc(nulls_first=True)
+                    if descending
+                    else F(name).asc(nulls_last=True)
+                    for name, descending in names
+                ])
+            yield clone.iterator(chunk_size)
+
+    def _merged(self, tiers, chunk_size=2000):
+        key = self._sort_key()
+        iterators = list(self._tier_iterators(tiers, chunk_size))
+        if key is None:
+            results = (result for iterator in iterators for result in iterator)
+        else:
+            results = heapq.merge(*iterators, key=key)
+        if self._iterable_class is ModelIterable:
+            results = _unique_by_pk(results)
+        low, high = self.query.low_mark, self.query.high_mark
+        for i, result in enumerate(results):
+            if high is not None and i >= high:
+                break
+            if i >= low:
+                yield result
+
+    def _fetch_all(self):
+        if self._result_cache is None and self._db is None:
+            tiers = self.tiers()
+            if len(tiers) > 1:
+                self._result_cache = list(self._merged(tiers))
+            else:
+                clone = self.using(tiers[0])
+                clone._fetch_all()
+                self._result_cache = clone._result_cache
+                self._prefetch_done = clone._prefetch_done
+        super(TieredQuerySet, self)._fetch_all()
+
+    def iterator(self, chunk_size=2000):
+        if self._db is not None:
+            return super(TieredQuerySet, self).iterator(chunk_size)
+        tiers = self.tiers()
+        if len(tiers) == 1:
+            return self.using(tiers[0]).iterator(chunk_size)
+        return self._merged(tiers, chunk_size)
+
+    def count(self):
+        if self._result_cache is not None or self._db is not None:
+            return super(TieredQuerySet, self).count()
+        tiers = self.tiers()
+        if len(tiers) > 1 and (self.query.low_mark or self.query.high_mark is not None):
+            return len(self)
+        return sum(self.using(alias).count() for alias in tiers)
+
+    def exists(self):
+        if self._result_cache is not None or self._db is not None:
+            return super(TieredQuerySet, self).exists()
+        return any(self.using(alias).exists() for alias in self.tiers())
+
+    def aggregate(self, *args, **kwargs):
+        if self._db is None and len(self.tiers()) > 1:
+            raise NotSupportedError(
+                "Aggregates can't be combined across tiers, use using() to "
+                "aggregate a single database."
+            )
+        return super(TieredQuerySet, self).aggregate(*args, **kwargs)
+
+    def update(self, **kwargs):
+        if self._db is not None:
+            return super(TieredQuerySet, self).update(**kwargs)
+        return sum(self.using(alias).update(**kwargs) for alias in self.tiers())
+
+    update.alters_data = True
+
+    def delete(self):
+        if self._db is not None:
+            return super(TieredQuerySet, self).delete()
+        deleted, per_model = 0, {}
+        for alias in self.tiers():
+            count, counts = self.using(alias).delete()
+            deleted += count
+            for label, value in counts.items():
+                per_model[label] = per_model.get(label, 0) + value
+        return deleted, per_model
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
+def _attr_getter(name):
+    return lambda obj: getattr(obj, name)
+
+
+def _identity(value):
+    return value
+
+
+def _item_getter(name):
+    return lambda row: row[name]
+
+
+def _unique_by_pk(objs):
+    seen = set()
+    for obj in objs:
+        if obj.pk not in seen:
+            seen.add(obj.pk)
+            yield obj
+
+
+class TieredManager(Manager.from_queryset(TieredQuerySet)):
+    def __init__(self, policy):
+        super(TieredManager, self).__init__()
+        self.policy = policy
+
+    def get_queryset(self):
+        queryset = super(TieredManager, self).get_queryset()
+        queryset.policy = self.policy
+        return queryset
+
+
+class NaiveTieringRouter(object):
+    """
+    Send reads and writes of tiered models to the hot database, unless the
+    object was loaded from the archive, and create their tables in both.
+    """
+
+    def _policy(self, model):
+        for manager in model._meta.managers:
+            policy = getattr(manager, "policy", None)
+            if isinstance(policy, NaiveTieringPolicy):
+                return policy
+        return None
+
+    def db_for_read(self, model, **hints):
+        policy = self._policy(model)
+        if policy is None:
+            return None
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db is not None:
+            return instance._state.db
+        return policy.hot
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        model = hints.get("model")
+        policy = self._policy(model) if model is not None else None
+        if policy is None:
+            return None
+        return db in (policy.hot, policy.archive)
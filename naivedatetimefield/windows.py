@@ -0,0 +1,187 @@
+"""
+Rolling aggregates over naive time, computed by the database.
+
+    Event.objects.annotate(
+        week_total=NaiveRollingWindow(
+            Sum("amount"),
+            order_by="naive",
+            preceding=timedelta(days=7),
+            partition_by=["timezone"],
+        )
+    )
+
+gives every row the sum of ``amount`` over the rows of the same timezone in
+the 7 days of local time up to and including it. Ordering by a naive Trunc
+expression and selecting distinct values returns one row per bucket:
+
+    Event.objects.annotate(
+        day=TruncDay("naive"),
+        week_total=NaiveRollingWindow(
+            Sum("amount"), TruncDay("naive"), timedelta(days=7), ["timezone"]
+        ),
+    ).values("timezone", "day", "week_total").distinct()
+
+PostgreSQL and MySQL frame the window with an interval, SQLite and MariaDB
+with the equivalent number of microseconds since the epoch. On databases
+without window functions, ``rolling_subquery()`` computes the same values
+with a correlated subquery.
+"""
+import datetime
+
+from django.db.models import (
+    BigIntegerField,
+    ExpressionWrapper,
+    F,
+    Func,
+    OuterRef,
+    Subquery,
+    Value,
+    Window,
+)
+from django.db.models.expressions import WindowFrame
+
+
+def _microseconds(delta):
+    if delta < datetime.timedelta(0):
+        raise ValueError("preceding must not be negative.")
+    return delta // datetime.timedelta(microseconds=1)
+
+
+class NaiveEpochMicroseconds(Func):
+    """
+    The number of microseconds from 1970-01-01 00:00:00 to a naive
+    timestamp or date, computed exactly on every backend.
+    """
+
+    output_field = BigIntegerField()
+    template = "CAST(EXTRACT(EPOCH FROM %(expressions)s) * 1000000 AS BIGINT)"
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler,
+            connection,
+            template="TIMESTAMPDIFF(MICROSECOND, '1970-01-01', %(expressions)s)",
+            **extra_context
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Seconds from strftime(), plus the fraction padded to six digits,
+        # as Django stores six but SQLite's own timestamps have three (and
+        # the fraction may be missing).
+        sql, params = compiler.compile(self.source_expressions[0])
+        return (
+            "(CAST(strftime('%%%%s', %s) AS INTEGER) * 1000000"
+            " + CAST(substr(substr(%s, 21) || '000000', 1, 6) AS INTEGER))"
+            % (sql, sql),
+            params * 2,
+        )
+
+
+def _numeric_frames(connection):
+    return connection.vendor == "sqlite" or (
+        connection.vendor == "mysql" and connection.mysql_is_mariadb
+    )
+
+
+class NaiveValueRange(WindowFrame):
+    """
+    A ``RANGE BETWEEN <preceding> PRECEDING AND CURRENT ROW`` frame over a
+    naive ordering, ``preceding`` being a timedelta.
+    """
+
+    frame_type = "RANGE"
+
+    def __init__(self, preceding):
+        self.preceding = preceding
+        super(NaiveValueRange, self).__init__(end=0)
+
+    def window_frame_start_end(self, connection, start, end):
+        delta = self.preceding
+        microseconds = _microseconds(delta)
+        if _numeric_frames(connection):
+            start = "%d" % microseconds
+        elif connection.vendor == "mysql":
+            start = "INTERVAL %d MICROSECOND" % microseconds
+        else:
+            start = "INTERVAL '%d days %d seconds %d microseconds'" % (
+                delta.days,
+                delta.seconds,
+                delta.microseconds,
+            )
+        return "%s %s" % (start, connection.ops.PRECEDING), connection.ops.CURRENT_ROW
+
+    def __str__(self):
+        return "RANGE BETWEEN %s PRECEDING AND CURRENT ROW" % self.preceding
+
+
+class NaiveRollingWindow(Window):
+    """
+    Compute ``expression`` over the rows whose ``order_by`` value is at most
+    ``preceding`` before the current row's, optionally within partitions.
+    ``order_by`` is the name of a naive field or a naive (or date)
+    expression, such as one of this module's Trunc functions.
+    """
+
+    def __init__(self, expression, order_by, preceding, partition_by=None, output_field=None):
+        _microseconds(preceding)
+        if isinstance(order_by, str):
+            order_by = F(order_by)
+        super(NaiveRollingWindow, self).__init__(
+            expression,
+            partition_by=partition_by,
+            order_by=[order_by],
+            frame=NaiveValueRange(preceding),
+            output_field=output_field,
+        )
+
+    def _numeric(self):
+        copy = self.copy()
+        copy.order_by = NaiveEpochMicroseconds(self.order_by)
+        return copy
+
+    def as_sqlite(self, compiler, connection):
+        window = super(NaiveRollingWindow, self._numeric())
+        # Window.as_sqlite() was added in Django 3.2
+        as_sqlite = getattr(window, "as_sqlite", window.as_sql)
+        return as_sqlite(compiler, connection)
+
+    def as_mysql(self, compiler, connection):
+        window = self._numeric() if connection.mysql_is_mariadb else self
+        return super(NaiveRollingWindow, window).as_sql(compiler, connection)
+
+
+def rolling_subquery(
+    queryset, expression, order_by, preceding, partition_by=(), output_field=None
+):
+    """
+    Return a subquery to annotate ``queryset`` with, computing the same
+    values as ``NaiveRollingWindow`` by aggregating the matching rows of
+    ``queryset`` for each row. ``order_by`` and ``partition_by`` are names
+    of fields or annotations of ``queryset``. ``output_field`` defaults to
+    the output field of ``expression``, if it has one before being resolved
+    (as Count does), and must be given otherwise on Django before 3.0.
+
+    This is a fallback for databases without window functions (or without
+    RANGE frames such as SQLite before 3.28). It reads the window of every
+    row separately, so order_by should be indexed.
+    """
+    microseconds = _microseconds(preceding)
+    current = NaiveEpochMicroseconds(OuterRef(order_by))
+    inner = queryset.order_by().annotate(
+        _rolling_at=NaiveEpochMicroseconds(order_by)
+    )
+    inner = inner.filter(
+        _rolling_at__gte=ExpressionWrapper(
+            current - Value(microseconds), output_field=BigIntegerField()
+        ),
+        _rolling_at__lte=current,
+        **{name: OuterRef(name) for name in partition_by}
+    )
+    # Grouping by a constant aggregates all the rows of the window
+    inner = inner.annotate(_rolling_group=Value(1)).values("_rolling_group")
+    if output_field is None:
+        output_field = getattr(expression, "_output_field_or_none", None)
+    return Subquery(
+        inner.annotate(_rolling_value=expression).values("_rolling_value"),
+        output_field=output_field,
+    )
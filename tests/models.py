@@ -1,6 +1,10 @@
-from django.db import models
+import datetime
 
-from naivedatetimefield import NaiveDateTimeField
+from django.db import connection, models
+
+from naivedatetimefield import MaterializedManager, NaiveDateTimeField
+from naivedatetimefield.ranges import NaiveDateTimeRangePair
+from naivedatetimefield.tiering import NaiveTieringPolicy, TieredManager
 
 
 class NaiveDateTimeTestModel(models.Model):
@@ -32,3 +36,72 @@ class NaiveDateTimeAutoNowModel(models.Model):
 
 class NullableNaiveDateTimeModel(models.Model):
     naive = NaiveDateTimeField(blank=True, null=True)
+
+
+class NaiveDateTimeIndexedModel(models.Model):
+    naive = NaiveDateTimeField(db_index=True)
+
+
+booking_during = NaiveDateTimeRangePair(
+    "start", "end", max_duration=datetime.timedelta(days=1)
+)
+
+
+class NaiveDateTimeBookingModel(models.Model):
+    start = NaiveDateTimeField()
+    end = NaiveDateTimeField()
+
+    class Meta:
+        ordering = ["pk"]
+        indexes = [booking_during.index("tests_booking_during_idx")]
+
+
+if connection.vendor == "postgresql":
+    from naivedatetimefield.postgres import NaiveDateTimeRangeField
+
+    class NaiveDateTimeRangeModel(models.Model):
+        during = NaiveDateTimeRangeField()
+
+        class Meta:
+            ordering = ["pk"]
+
+
+class NaiveDateTimeChildModel(models.Model):
+    parent = models.ForeignKey(
+        NaiveDateTimeTestModel, models.CASCADE, related_name="children"
+    )
+    naive = NaiveDateTimeField()
+
+    class Meta:
+        ordering = ["pk"]
+
+
+class NaiveDateTimeMaterializedModel(models.Model):
+    naive = NaiveDateTimeField(materialize=("date", "hour"))
+
+    objects = MaterializedManager()
+
+    class Meta:
+        ordering = ["pk"]
+
+
+class NaiveDateTimeInternedModel(models.Model):
+    naive = NaiveDateTimeField(intern=2)
+
+    class Meta:
+        ordering = ["pk"]
+
+
+tiering_policy = NaiveTieringPolicy(
+    "naive", hot="default", archive="archive", age=datetime.timedelta(days=30)
+)
+
+
+class NaiveDateTimeTieredModel(models.Model):
+    naive = NaiveDateTimeField(db_index=True)
+    rank = models.IntegerField(null=True)
+
+    objects = TieredManager(tiering_policy)
+
+    class Meta:
+        ordering = ["naive", "pk"]
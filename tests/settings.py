@@ -1,7 +1,7 @@
 import os
 
 SECRET_KEY = "fake-key"
-INSTALLED_APPS = ["tests"]
+INSTALLED_APPS = ["naivedatetimefield", "tests"]
 
 AVAILABLE_DATABASES = {
     "sqlite": {
@@ -26,7 +26,12 @@ AVAILABLE_DATABASES = {
     },
 }
 
-DATABASES = {"default": AVAILABLE_DATABASES[os.environ.get("DB", "postgres")]}
+DATABASES = {
+    "default": AVAILABLE_DATABASES[os.environ.get("DB", "postgres")],
+    "archive": dict(AVAILABLE_DATABASES["sqlite"]),
+}
+
+DATABASE_ROUTERS = ["naivedatetimefield.tiering.NaiveTieringRouter"]
 
 DEBUG = True
 
@@ -1,22 +1,60 @@
+import contextlib
 import datetime
+import threading
+from io import StringIO
 from unittest import skipIf
 
+import django
 import pytz
 from django import db
-from django.db import connection
+from django.db import connection, models
+from django.apps.registry import Apps
+from django.core.management import CommandError, call_command
+from django.db.migrations.operations import AddField
+from django.db.migrations.state import ModelState, ProjectState
 from django.db.models import functions, Value
-from django.test import TestCase, override_settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 import naivedatetimefield
-from naivedatetimefield import AtTimeZone
+from naivedatetimefield import AtTimeZone, NaiveNow, refresh_materialized
+from naivedatetimefield.analyzer import NaiveQueryAnalyzer
+from naivedatetimefield.operations import ConvertToNaiveDateTimeField
+from naivedatetimefield.changes import ChangeExtractor
+from naivedatetimefield.retention import purge
+from naivedatetimefield.tiering import NaiveTieringRouter
+from naivedatetimefield.windows import (
+    NaiveEpochMicroseconds,
+    NaiveRollingWindow,
+    rolling_subquery,
+)
 from .models import (
     NaiveDateTimeTestModel,
     NaiveDateTimeAutoNowAddModel,
     NaiveDateTimeAutoNowModel,
+    NaiveDateTimeBookingModel,
+    NaiveDateTimeChildModel,
+    NaiveDateTimeIndexedModel,
+    NaiveDateTimeInternedModel,
+    NaiveDateTimeMaterializedModel,
+    NaiveDateTimeTieredModel,
     NullableNaiveDateTimeModel,
+    booking_during,
+    tiering_policy,
 )
 
+if django.VERSION >= (3, 1):
+    from asgiref.sync import sync_to_async
+
+    from naivedatetimefield.streaming import astream
+
+if connection.vendor == "postgresql":
+    from psycopg2.extras import DateTimeRange
+
+    from naivedatetimefield.postgres import TsRange
+    from .models import NaiveDateTimeRangeModel
+
 
 class NaiveDateTimeFieldTestCase(TestCase):
     """
@@ -280,6 +318,65 @@ class NaiveDateTimeFieldTestCase(TestCase):
             [2017, 12, 31, 20, 10, 30, 52, 1],
         )
 
+    @skipIf(django.VERSION < (3, 1), "ExtractIsoWeekDay was added in Django 3.1")
+    def test_calendar_transforms(self):
+        """
+        Test the less common truncations and extracts against Python's
+        calendar, around week and year boundaries.
+        """
+        datetimes = [
+            datetime.datetime(2017, 1, 1, 23, 59, 59, 999999),  # Sunday
+            datetime.datetime(2017, 1, 2, 0, 0),  # Monday
+            datetime.datetime(2018, 12, 31, 12, 30, 15),  # ISO year 2019
+            datetime.datetime(2020, 5, 9, 6, 5, 4, 3),
+        ]
+        NaiveDateTimeTestModel.objects.bulk_create(
+            NaiveDateTimeTestModel(aware=timezone.make_aware(dt), naive=dt)
+            for dt in datetimes
+        )
+
+        with timezone.override("Pacific/Chatham"):
+            rows = NaiveDateTimeTestModel.objects.annotate(
+                quarter=naivedatetimefield.ExtractQuarter("naive"),
+                iso_year=naivedatetimefield.ExtractIsoYear("naive"),
+                week=naivedatetimefield.ExtractWeek("naive"),
+                iso_week_day=naivedatetimefield.ExtractIsoWeekDay("naive"),
+                trunc_quarter=naivedatetimefield.TruncQuarter("naive"),
+                trunc_week=naivedatetimefield.TruncWeek("naive"),
+                trunc_month_date=naivedatetimefield.TruncMonth(
+                    "naive", output_field=models.DateField()
+                ),
+                time=naivedatetimefield.TruncTime("naive"),
+            ).values_list(
+                "quarter",
+                "iso_year",
+                "week",
+                "iso_week_day",
+                "trunc_quarter",
+                "trunc_week",
+                "trunc_month_date",
+                "time",
+            )
+
+            expected = []
+            for dt in datetimes:
+                iso_year, week, iso_week_day = dt.isocalendar()
+                quarter_month = dt.month - (dt.month - 1) % 3
+                monday = dt.date() - datetime.timedelta(days=dt.weekday())
+                expected.append(
+                    (
+                        (dt.month + 2) // 3,
+                        iso_year,
+                        week,
+                        iso_week_day,
+                        datetime.datetime(dt.year, quarter_month, 1),
+                        datetime.datetime(monday.year, monday.month, monday.day),
+                        datetime.date(dt.year, dt.month, 1),
+                        dt.time(),
+                    )
+                )
+            self.assertEqual(list(rows), expected)
+
     def test_add_los_angeles_local_timestamp(self):
         """
         activate a timezone that's not the default tz and is also not utc
@@ -547,3 +644,1158 @@ class AtTimeZoneTests(TestCase):
             [self.sydney],
             transform=identity,
         )
+
+
+class NaiveQueryAnalyzerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        NaiveDateTimeIndexedModel.objects.create(
+            naive=datetime.datetime(2019, 1, 15, 10)
+        )
+
+    def test_flags_function_on_indexed_column(self):
+        with NaiveQueryAnalyzer(log=False) as analyzer:
+            list(NaiveDateTimeIndexedModel.objects.filter(naive__hour__gte=9))
+            list(
+                NaiveDateTimeIndexedModel.objects.filter(
+                    naive__date=datetime.date(2019, 1, 15)
+                )
+            )
+
+        self.assertEqual(len(analyzer.offenders), 2)
+        hour, date = analyzer.offenders
+        self.assertEqual(hour.column, "tests.NaiveDateTimeIndexedModel.naive")
+        self.assertIn("Extracted parts", hour.suggestion)
+        self.assertIn("range instead of the date", date.suggestion)
+        self.assertIn("tests.py", "".join(hour.stack))
+        self.assertIsNone(hour.plan)
+        self.assertIn("NaiveDateTimeIndexedModel.naive", analyzer.report())
+
+    def test_ignores_sargable_and_unindexed_filters(self):
+        with NaiveQueryAnalyzer(log=False) as analyzer:
+            list(
+                NaiveDateTimeIndexedModel.objects.filter(
+                    naive__gte=datetime.datetime(2019, 1, 15),
+                    naive__lt=datetime.datetime(2019, 1, 16),
+                )
+            )
+            list(
+                NaiveDateTimeIndexedModel.objects.annotate(
+                    hour=naivedatetimefield.ExtractHour("naive")
+                )
+            )
+            list(NaiveDateTimeTestModel.objects.filter(naive__hour__gte=9))
+
+        self.assertEqual(analyzer.offenders, [])
+
+    def test_explain_sample(self):
+        with NaiveQueryAnalyzer(log=False, sample_rate=1) as analyzer:
+            list(NaiveDateTimeIndexedModel.objects.filter(naive__hour__gte=9))
+
+        self.assertEqual(len(analyzer.offenders), 1)
+        self.assertTrue(analyzer.offenders[0].plan)
+        self.assertNotIn("EXPLAIN failed", analyzer.offenders[0].plan)
+
+    def test_explain_in_other_thread(self):
+        analyzer = NaiveQueryAnalyzer(log=False)
+
+        def explaining():
+            analyzer._local.explaining = True
+
+        thread = threading.Thread(target=explaining)
+        thread.start()
+        thread.join()
+        with analyzer:
+            list(NaiveDateTimeIndexedModel.objects.filter(naive__hour__gte=9))
+        self.assertEqual(len(analyzer.offenders), 1)
+
+    def test_aliased_column(self):
+        hours = NaiveDateTimeIndexedModel.objects.filter(naive__hour__gte=9)
+        with NaiveQueryAnalyzer(log=False) as analyzer:
+            list(
+                NaiveDateTimeIndexedModel.objects.filter(
+                    pk__in=hours.values("pk")
+                )
+            )
+
+        self.assertEqual(len(analyzer.offenders), 1)
+        self.assertIn('U0."naive"', analyzer.offenders[0].function)
+
+    def test_uninstall_other_thread(self):
+        analyzer = NaiveQueryAnalyzer(log=False)
+        wrappers = []
+
+        def connecting():
+            db.connections["default"].ensure_connection()
+            wrappers.append(db.connections["default"].execute_wrappers)
+            db.connections["default"].close()
+
+        analyzer.install()
+        try:
+            thread = threading.Thread(target=connecting)
+            thread.start()
+            thread.join()
+            self.assertIn(analyzer, wrappers[0])
+        finally:
+            analyzer.uninstall()
+        self.assertNotIn(analyzer, wrappers[0])
+        self.assertNotIn(analyzer, connection.execute_wrappers)
+
+
+class NaiveNowTests(TestCase):
+    def test_annotate(self):
+        o = NullableNaiveDateTimeModel.objects.create()
+        before = timezone.make_naive(timezone.now())
+        o = NullableNaiveDateTimeModel.objects.annotate(
+            now=NaiveNow(), hour_ago=NaiveNow() - datetime.timedelta(hours=1)
+        ).get(pk=o.pk)
+        after = timezone.make_naive(timezone.now())
+
+        self.assertTrue(timezone.is_naive(o.now))
+        self.assertTrue(timezone.is_naive(o.hour_ago))
+        # Databases may only store the current time with second precision
+        self.assertLessEqual(before.replace(microsecond=0), o.now)
+        self.assertLessEqual(o.now, after)
+        self.assertEqual(o.now - o.hour_ago, datetime.timedelta(hours=1))
+
+    def test_relative_filter(self):
+        now = timezone.make_naive(timezone.now())
+        recent = NullableNaiveDateTimeModel.objects.create(
+            naive=now - datetime.timedelta(minutes=30)
+        )
+        NullableNaiveDateTimeModel.objects.create(
+            naive=now - datetime.timedelta(hours=2)
+        )
+        NullableNaiveDateTimeModel.objects.create(
+            naive=now + datetime.timedelta(hours=2)
+        )
+
+        self.assertQuerysetEqual(
+            NullableNaiveDateTimeModel.objects.filter(
+                naive__gte=NaiveNow() - datetime.timedelta(hours=1),
+                naive__lte=NaiveNow(),
+            ),
+            [recent],
+            transform=identity,
+        )
+
+    @timezone.override("Australia/Perth")
+    def test_timezone(self):
+        obj = NaiveDateTimeAutoNowModel.objects.create()
+        o = NullableNaiveDateTimeModel.objects.annotate(
+            now=NaiveNow(),
+            utc_now=NaiveNow(pytz.utc),
+            hour_ago=NaiveNow() - datetime.timedelta(hours=1),
+        ).get(pk=NullableNaiveDateTimeModel.objects.create().pk)
+        # Perth is 8 hours ahead of UTC, and auto_now uses local time too
+        self.assertEqual(o.now - o.utc_now, datetime.timedelta(hours=8))
+        self.assertLessEqual(o.hour_ago, obj.naive)
+        self.assertLessEqual(obj.naive.replace(microsecond=0), o.now)
+
+
+class ConvertToNaiveDateTimeFieldTests(TransactionTestCase):
+    available_apps = ["tests"]
+    app_label = "test_convert_naive"
+
+    def setUp(self):
+        self.state = ProjectState()
+        self.state.add_model(
+            ModelState(
+                self.app_label,
+                "Event",
+                [
+                    ("id", models.AutoField(primary_key=True)),
+                    ("when", models.DateTimeField()),
+                    ("timezone", models.CharField(max_length=100)),
+                ],
+            )
+        )
+        self.model = self.state.apps.get_model(self.app_label, "Event")
+        with connection.schema_editor() as editor:
+            editor.create_model(self.model)
+
+        utc = datetime.datetime(2019, 1, 15, 2, tzinfo=pytz.utc)
+        self.model.objects.bulk_create(
+            self.model(when=utc, timezone=tz)
+            for tz in ["Australia/Perth", "Australia/Sydney", "UTC"] * 3
+        )
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            editor.delete_model(self.model)
+
+    def migrate(self, operation):
+        new_state = self.state.clone()
+        operation.state_forwards(self.app_label, new_state)
+        with connection.schema_editor(atomic=False) as editor:
+            operation.database_forwards(self.app_label, editor, self.state, new_state)
+        self.model = new_state.apps.get_model(self.app_label, "Event")
+
+    def test_convert(self):
+        batches = []
+        operation = ConvertToNaiveDateTimeField(
+            "Event",
+            "when",
+            naivedatetimefield.NaiveDateTimeField(db_index=True),
+            timezone_field="timezone",
+            batch_size=4,
+            progress=lambda *args: batches.append(args),
+        )
+        self.migrate(operation)
+
+        self.assertEqual(
+            list(self.model.objects.order_by("pk").values_list("when", flat=True)),
+            [
+                datetime.datetime(2019, 1, 15, 10),
+                datetime.datetime(2019, 1, 15, 13),
+                datetime.datetime(2019, 1, 15, 2),
+            ]
+            * 3,
+        )
+        self.assertEqual(
+            [batch[:3] for batch in batches], [(4, 4, 9), (8, 8, 9), (9, 9, 9)]
+        )
+        field = self.model._meta.get_field("when")
+        self.assertIsInstance(field, naivedatetimefield.NaiveDateTimeField)
+        self.assertTrue(field.db_index)
+
+    def test_resume(self):
+        operation = ConvertToNaiveDateTimeField(
+            "Event",
+            "when",
+            naivedatetimefield.NaiveDateTimeField(),
+            tz="Australia/Adelaide",
+        )
+        # Simulate a previous run that failed after converting some rows
+        partial_state = self.state.clone()
+        add_field = AddField("Event", "when_naive", operation._temp_field())
+        add_field.state_forwards(self.app_label, partial_state)
+        with connection.schema_editor() as editor:
+            add_field.database_forwards(
+                self.app_label, editor, self.state, partial_state
+            )
+        partial = partial_state.apps.get_model(self.app_label, "Event")
+        marker = datetime.datetime(2000, 1, 1)
+        partial.objects.filter(pk__lte=3).update(when_naive=marker)
+
+        converted = []
+        operation.progress = lambda *args: converted.append(args[0])
+        self.migrate(operation)
+
+        values = list(self.model.objects.order_by("pk").values_list("when", flat=True))
+        self.assertEqual(values[:3], [marker] * 3)
+        self.assertEqual(values[3:], [datetime.datetime(2019, 1, 15, 12, 30)] * 6)
+        self.assertEqual(converted, [6])
+
+    def test_concurrent_writes(self):
+        utc = datetime.datetime(2019, 1, 15, 2, tzinfo=pytz.utc)
+
+        def write(converted, *args):
+            # Rows inserted, and converted rows updated, during the backfill
+            if converted == 4:
+                self.model.objects.create(when=utc, timezone="Australia/Perth")
+                self.model.objects.filter(pk=1).update(timezone="UTC")
+
+        operation = ConvertToNaiveDateTimeField(
+            "Event",
+            "when",
+            naivedatetimefield.NaiveDateTimeField(),
+            timezone_field="timezone",
+            batch_size=4,
+            progress=write,
+        )
+        self.migrate(operation)
+
+        values = list(self.model.objects.order_by("pk").values_list("when", flat=True))
+        self.assertEqual(values[0], datetime.datetime(2019, 1, 15, 2))
+        self.assertEqual(values[9], datetime.datetime(2019, 1, 15, 10))
+        self.assertNotIn(None, values)
+
+    def test_locked_phase_uses_index(self):
+        operation = ConvertToNaiveDateTimeField(
+            "Event",
+            "when",
+            naivedatetimefield.NaiveDateTimeField(),
+            timezone_field="timezone",
+            batch_size=4,
+        )
+        plans = []
+
+        def explain(execute, sql, params, many, context):
+            if sql.startswith("SELECT"):
+                plan = ""
+                if connection.vendor == "sqlite":
+                    context["cursor"].execute("EXPLAIN QUERY PLAN " + sql, params)
+                    plan = " ".join(str(row) for row in context["cursor"].fetchall())
+                plans.append(plan)
+            return execute(sql, params, many, context)
+
+        lock = operation._lock
+
+        @contextlib.contextmanager
+        def explaining_lock(model, connection):
+            with lock(model, connection), connection.execute_wrapper(explain):
+                yield
+
+        operation._lock = explaining_lock
+        self.migrate(operation)
+
+        if connection.vendor == "postgresql":
+            self.assertEqual(plans, [])
+        elif connection.vendor == "sqlite":
+            self.assertTrue(plans)
+            for plan in plans:
+                self.assertIn("_pending", plan)
+
+    def test_keeps_aware_column(self):
+        operation = ConvertToNaiveDateTimeField(
+            "Event", "when", naivedatetimefield.NaiveDateTimeField(null=True), tz="UTC"
+        )
+        # Only the first pass converts anything, as if the row written
+        # during it couldn't be converted.
+        backfill = operation.backfill
+        passes = []
+
+        def first_pass(*args):
+            passes.append(args)
+            return backfill(*args) if len(passes) == 1 else 0
+
+        operation.backfill = first_pass
+        operation.progress = lambda *args: self.model.objects.create(
+            when=datetime.datetime(2019, 1, 15, 2, tzinfo=pytz.utc), timezone="UTC"
+        )
+        with self.assertRaises(db.DatabaseError):
+            self.migrate(operation)
+        with connection.cursor() as cursor:
+            columns = [
+                info.name
+                for info in connection.introspection.get_table_description(
+                    cursor, self.model._meta.db_table
+                )
+            ]
+        self.assertIn("when", columns)
+        self.assertIn("when_naive", columns)
+
+
+class NaiveDateTimeRangePairTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.morning = NaiveDateTimeBookingModel.objects.create(
+            start=datetime.datetime(2019, 1, 15, 9),
+            end=datetime.datetime(2019, 1, 15, 12),
+        )
+        cls.afternoon = NaiveDateTimeBookingModel.objects.create(
+            start=datetime.datetime(2019, 1, 15, 12),
+            end=datetime.datetime(2019, 1, 15, 17),
+        )
+        cls.yesterday = NaiveDateTimeBookingModel.objects.create(
+            start=datetime.datetime(2019, 1, 14, 9),
+            end=datetime.datetime(2019, 1, 14, 17),
+        )
+
+    def assertBookings(self, q, expected):
+        self.assertQuerysetEqual(
+            NaiveDateTimeBookingModel.objects.filter(q), expected, transform=identity
+        )
+
+    def test_overlap(self):
+        self.assertBookings(
+            booking_during.overlap(
+                datetime.datetime(2019, 1, 15, 11), datetime.datetime(2019, 1, 15, 13)
+            ),
+            [self.morning, self.afternoon],
+        )
+        self.assertBookings(
+            booking_during.overlap(
+                datetime.datetime(2019, 1, 14, 17), datetime.datetime(2019, 1, 15, 9)
+            ),
+            [],
+        )
+
+    def test_contains(self):
+        self.assertBookings(
+            booking_during.contains(datetime.datetime(2019, 1, 15, 12)),
+            [self.afternoon],
+        )
+
+    def test_contained_by(self):
+        self.assertBookings(
+            booking_during.contained_by(
+                datetime.datetime(2019, 1, 15), datetime.datetime(2019, 1, 16)
+            ),
+            [self.morning, self.afternoon],
+        )
+
+    def test_adjacent(self):
+        self.assertBookings(
+            booking_during.adjacent(
+                datetime.datetime(2019, 1, 14, 17), datetime.datetime(2019, 1, 15, 9)
+            ),
+            [self.morning, self.yesterday],
+        )
+
+    def test_max_duration_bounds_start(self):
+        sql = str(
+            NaiveDateTimeBookingModel.objects.filter(
+                booking_during.overlap(
+                    datetime.datetime(2019, 1, 15, 11),
+                    datetime.datetime(2019, 1, 15, 13),
+                )
+            ).query
+        )
+        self.assertIn("2019-01-14 11:00:00", sql)
+
+
+@skipIf(connection.vendor != "postgresql", "tsrange is only supported in PostgreSQL")
+class NaiveDateTimeRangeFieldTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.morning = NaiveDateTimeRangeModel.objects.create(
+            during=(
+                datetime.datetime(2019, 1, 15, 9),
+                datetime.datetime(2019, 1, 15, 12),
+            )
+        )
+        cls.afternoon = NaiveDateTimeRangeModel.objects.create(
+            during=DateTimeRange(
+                datetime.datetime(2019, 1, 15, 12), datetime.datetime(2019, 1, 15, 17)
+            )
+        )
+
+    def test_round_trip(self):
+        self.morning.refresh_from_db()
+        self.assertEqual(
+            self.morning.during,
+            DateTimeRange(
+                datetime.datetime(2019, 1, 15, 9), datetime.datetime(2019, 1, 15, 12)
+            ),
+        )
+
+    def test_lookups(self):
+        def filter(**kwargs):
+            return NaiveDateTimeRangeModel.objects.filter(**kwargs)
+
+        with timezone.override("Pacific/Chatham"):
+            self.assertQuerysetEqual(
+                filter(during__contains=datetime.datetime(2019, 1, 15, 12)),
+                [self.afternoon],
+                transform=identity,
+            )
+            self.assertQuerysetEqual(
+                filter(
+                    during__overlap=(
+                        datetime.datetime(2019, 1, 15, 11),
+                        datetime.datetime(2019, 1, 15, 13),
+                    )
+                ),
+                [self.morning, self.afternoon],
+                transform=identity,
+            )
+            self.assertQuerysetEqual(
+                filter(
+                    during__adjacent_to=(
+                        datetime.datetime(2019, 1, 15, 17),
+                        datetime.datetime(2019, 1, 15, 18),
+                    )
+                ),
+                [self.afternoon],
+                transform=identity,
+            )
+
+    def test_contained_by_and_tsrange(self):
+        obj = NaiveDateTimeTestModel.objects.create(
+            naive=datetime.datetime(2019, 1, 15, 10),
+            aware=timezone.now(),
+        )
+        self.assertQuerysetEqual(
+            NaiveDateTimeTestModel.objects.filter(
+                naive__contained_by=(
+                    datetime.datetime(2019, 1, 15),
+                    datetime.datetime(2019, 1, 16),
+                )
+            ),
+            [obj],
+            transform=identity,
+        )
+        self.assertQuerysetEqual(
+            NaiveDateTimeRangeModel.objects.filter(
+                during__overlap=TsRange(
+                    Value(
+                        datetime.datetime(2019, 1, 15, 16),
+                        output_field=naivedatetimefield.NaiveDateTimeField(),
+                    ),
+                    Value(
+                        datetime.datetime(2019, 1, 15, 18),
+                        output_field=naivedatetimefield.NaiveDateTimeField(),
+                    ),
+                )
+            ),
+            [self.afternoon],
+            transform=identity,
+        )
+
+
+@skipIf(django.VERSION < (3, 1), "Async tests require Django 3.1")
+class AsyncStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.datetimes = [
+            datetime.datetime(2019, 1, 15, hour, minute, 30, 123456)
+            for hour in range(3)
+            for minute in range(0, 60, 25)
+        ]
+        NaiveDateTimeTestModel.objects.bulk_create(
+            NaiveDateTimeTestModel(naive=dt, aware=timezone.make_aware(dt))
+            for dt in cls.datetimes
+        )
+
+    async def test_stream(self):
+        objs = [
+            obj
+            async for obj in astream(
+                NaiveDateTimeTestModel.objects.annotate(
+                    hour=naivedatetimefield.ExtractHour("naive")
+                ),
+                chunk_size=4,
+                offload_threshold=4,
+            )
+        ]
+
+        self.assertEqual([obj.naive for obj in objs], self.datetimes)
+        self.assertEqual([obj.hour for obj in objs], [dt.hour for dt in self.datetimes])
+        self.assertTrue(all(timezone.is_aware(obj.aware) for obj in objs))
+
+    async def test_values_not_supported(self):
+        with self.assertRaises(TypeError):
+            async for row in astream(NaiveDateTimeTestModel.objects.values()):
+                pass
+
+    async def test_prefetch_related_not_supported(self):
+        queryset = NaiveDateTimeTestModel.objects.prefetch_related("children")
+        with self.assertRaises(TypeError):
+            async for obj in astream(queryset):
+                pass
+
+    async def test_related_manager(self):
+        parent = await sync_to_async(self.create_children)()
+        objs = [obj async for obj in astream(parent.children.all())]
+        self.assertEqual([obj.naive for obj in objs], self.datetimes[:2])
+        # Known from the related manager, without another query
+        self.assertTrue(all(obj.parent is parent for obj in objs))
+
+    def create_children(self):
+        parent = NaiveDateTimeTestModel.objects.first()
+        NaiveDateTimeChildModel.objects.bulk_create(
+            NaiveDateTimeChildModel(parent=parent, naive=dt)
+            for dt in self.datetimes[:2]
+        )
+        return parent
+
+
+class MaterializeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.morning = NaiveDateTimeMaterializedModel.objects.create(
+            naive=datetime.datetime(2019, 1, 15, 9, 30)
+        )
+        cls.evening = NaiveDateTimeMaterializedModel.objects.create(
+            naive=datetime.datetime(2019, 1, 16, 19, 45)
+        )
+
+    def test_companion_fields(self):
+        self.assertEqual(self.morning.naive_date, datetime.date(2019, 1, 15))
+        self.assertEqual(self.morning.naive_hour, 9)
+        field = NaiveDateTimeMaterializedModel._meta.get_field("naive_hour")
+        self.assertTrue(field.db_index)
+        self.assertFalse(field.editable)
+
+    def test_lookups_use_companion_columns(self):
+        qs = NaiveDateTimeMaterializedModel.objects.filter(
+            naive__date=datetime.date(2019, 1, 15), naive__hour__lt=12
+        )
+        self.assertQuerysetEqual(qs, [self.morning], transform=identity)
+        where = str(qs.query).split("WHERE")[1]
+        self.assertIn("naive_date", where)
+        self.assertIn("naive_hour", where)
+
+        qs = NaiveDateTimeMaterializedModel.objects.annotate(
+            hour=naivedatetimefield.ExtractHour("naive"),
+            minute=naivedatetimefield.ExtractMinute("naive"),
+        )
+        self.assertEqual(list(qs.values_list("hour", "minute")), [(9, 30), (19, 45)])
+        self.assertIn("naive_hour", str(qs.query))
+
+    def test_save_update_fields(self):
+        self.morning.naive = datetime.datetime(2019, 1, 18, 14)
+        self.morning.save(update_fields=["naive"])
+        obj = NaiveDateTimeMaterializedModel.objects.only("naive").get(
+            naive__date=datetime.date(2019, 1, 18), naive__hour=14
+        )
+        self.assertEqual(obj.pk, self.morning.pk)
+
+        # Saving a deferred instance only saves the loaded fields
+        obj.naive = datetime.datetime(2019, 1, 19, 8)
+        obj.save()
+        self.assertEqual(
+            NaiveDateTimeMaterializedModel.objects.filter(
+                naive__date=datetime.date(2019, 1, 19), naive__hour=8
+            ).get(),
+            self.morning,
+        )
+
+    def test_plain_querysets(self):
+        # Other managers neither read nor update the companion columns
+        plain = NaiveDateTimeMaterializedModel._base_manager
+        plain.filter(pk=self.evening.pk).update(naive=datetime.datetime(2019, 1, 17, 7))
+        qs = plain.filter(naive__hour=7)
+        self.assertQuerysetEqual(qs, [self.evening], transform=identity)
+        self.assertNotIn("naive_hour", str(qs.query).split("WHERE")[1])
+        self.assertEqual(
+            NaiveDateTimeMaterializedModel.objects.get(pk=self.evening.pk).naive_hour,
+            19,
+        )
+
+    def test_update(self):
+        qs = NaiveDateTimeMaterializedModel.objects.all()
+        qs.filter(pk=self.evening.pk).update(naive=datetime.datetime(2021, 6, 6, 23))
+        self.assertQuerysetEqual(
+            qs.filter(naive__hour=23), [self.evening], transform=identity
+        )
+        qs.filter(pk=self.morning.pk).update(
+            naive=models.F("naive") + datetime.timedelta(hours=2)
+        )
+        self.assertQuerysetEqual(
+            qs.filter(naive__hour=11), [self.morning], transform=identity
+        )
+
+        self.morning.naive = datetime.datetime(2020, 2, 29, 5)
+        qs.bulk_update([self.morning], ["naive"])
+        self.assertQuerysetEqual(
+            qs.filter(naive__date=datetime.date(2020, 2, 29), naive__hour=5),
+            [self.morning],
+            transform=identity,
+        )
+
+    def test_refresh_materialized(self):
+        NaiveDateTimeMaterializedModel._base_manager.filter(
+            pk=self.evening.pk
+        ).update(naive=datetime.datetime(2019, 1, 17, 7))
+        self.assertEqual(
+            refresh_materialized(NaiveDateTimeMaterializedModel.objects.all()), 2
+        )
+        self.assertEqual(
+            list(
+                NaiveDateTimeMaterializedModel.objects.values_list(
+                    "naive_date", "naive_hour"
+                )
+            ),
+            [(datetime.date(2019, 1, 15), 9), (datetime.date(2019, 1, 17), 7)],
+        )
+
+    def test_migration_state(self):
+        state = ModelState.from_model(NaiveDateTimeMaterializedModel)
+        # A list of (name, field) pairs before Django 3.1
+        fields = dict(state.fields)
+        self.assertEqual(list(fields), ["id", "naive", "naive_date", "naive_hour"])
+        self.assertEqual(
+            fields["naive_hour"].deconstruct()[3],
+            {"source": "naive", "part": "hour"},
+        )
+        model = state.render(Apps())
+        self.assertEqual(
+            [field.name for field in model._meta.fields],
+            ["id", "naive", "naive_date", "naive_hour"],
+        )
+
+    def test_invalid_part(self):
+        field = naivedatetimefield.NaiveDateTimeField(materialize=["fortnight"])
+        field.set_attributes_from_name("naive")
+        self.assertEqual(
+            [error.id for error in field._check_materialize()],
+            ["naivedatetimefield.E001"],
+        )
+
+
+class InternTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.datetimes = [
+            datetime.datetime(2019, 1, 15, 9, minute % 3) for minute in range(7)
+        ]
+        NaiveDateTimeInternedModel.objects.bulk_create(
+            NaiveDateTimeInternedModel(naive=dt) for dt in cls.datetimes
+        )
+
+    def assertInterned(self, values):
+        self.assertEqual(values, self.datetimes)
+        self.assertIs(values[0], values[3])
+        self.assertIs(values[0], values[6])
+        self.assertIs(values[1], values[4])
+        # The cache is full by the time the third value is read
+        self.assertIsNot(values[2], values[5])
+
+    def test_intern(self):
+        self.assertInterned(
+            list(NaiveDateTimeInternedModel.objects.values_list("naive", flat=True))
+        )
+        self.assertInterned(
+            [obj.naive for obj in NaiveDateTimeInternedModel.objects.all()]
+        )
+        # Each query has its own cache
+        self.assertIsNot(
+            NaiveDateTimeInternedModel.objects.first().naive,
+            NaiveDateTimeInternedModel.objects.first().naive,
+        )
+
+    @skipIf(django.VERSION < (3, 1), "Async tests require Django 3.1")
+    async def test_astream(self):
+        objs = [
+            obj
+            async for obj in astream(
+                NaiveDateTimeInternedModel.objects.all(), chunk_size=2
+            )
+        ]
+        self.assertInterned([obj.naive for obj in objs])
+
+    def test_connection_without_hook(self):
+        # As for a connection opened before any field used intern
+        ops = connection.ops
+        self.addCleanup(setattr, ops, "get_db_converters", ops.get_db_converters)
+        self.addCleanup(
+            setattr, ops, "naive_backend_converters", ops.naive_backend_converters
+        )
+        del ops.get_db_converters
+        del ops.naive_backend_converters
+        self.assertInterned(
+            list(NaiveDateTimeInternedModel.objects.values_list("naive", flat=True))
+        )
+        self.assertInterned(
+            [obj.naive for obj in NaiveDateTimeInternedModel.objects.all()]
+        )
+
+    def test_deconstruct(self):
+        field = NaiveDateTimeInternedModel._meta.get_field("naive")
+        self.assertEqual(field.deconstruct()[3], {"intern": 2})
+        self.assertEqual(
+            naivedatetimefield.NaiveDateTimeField(intern=True).intern_cache_size,
+            naivedatetimefield.NaiveDateTimeField.INTERN_CACHE_SIZE,
+        )
+
+
+class TieringTests(TestCase):
+    databases = {"default", "archive"}
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.make_naive(timezone.now())
+        cls.recent = now - datetime.timedelta(days=1)
+        cls.old = now - datetime.timedelta(days=60)
+        for days in (90, 1, 60, 0):
+            NaiveDateTimeTieredModel.objects.create(
+                naive=now - datetime.timedelta(days=days)
+            )
+        cls.moved = tiering_policy.move_to_archive(
+            NaiveDateTimeTieredModel, batch_size=1
+        )
+
+    def test_move_to_archive(self):
+        self.assertEqual(self.moved, 2)
+        cutoff = tiering_policy.cutoff()
+        hot = NaiveDateTimeTieredModel.objects.using("default")
+        archive = NaiveDateTimeTieredModel.objects.using("archive")
+        self.assertEqual(hot.count(), 2)
+        self.assertFalse(hot.filter(naive__lt=cutoff).exists())
+        self.assertEqual(archive.count(), 2)
+        self.assertFalse(archive.filter(naive__gte=cutoff).exists())
+
+    def test_routing(self):
+        with self.assertNumQueries(0, using="archive"):
+            recent = list(
+                NaiveDateTimeTieredModel.objects.filter(naive__gte=self.recent)
+            )
+        self.assertEqual(len(recent), 2)
+        self.assertEqual({obj._state.db for obj in recent}, {"default"})
+
+        with self.assertNumQueries(0, using="default"):
+            old = list(
+                NaiveDateTimeTieredModel.objects.filter(
+                    naive__date__gt=datetime.date(2000, 1, 1),
+                    naive__range=(datetime.date(2000, 1, 1), self.old),
+                )
+            )
+        self.assertEqual(len(old), 2)
+        self.assertEqual({obj._state.db for obj in old}, {"archive"})
+
+    def test_merge(self):
+        qs = NaiveDateTimeTieredModel.objects.all()
+        values = [obj.naive for obj in qs]
+        self.assertEqual(len(values), 4)
+        self.assertEqual(values, sorted(values))
+
+        values = list(qs.order_by("-naive").values_list("naive", flat=True))
+        self.assertEqual(values, sorted(values, reverse=True))
+        self.assertEqual(
+            list(qs.order_by("-naive").values_list("naive", flat=True)[1:3]),
+            values[1:3],
+        )
+        self.assertEqual(
+            [row["naive"] for row in qs.values("naive").iterator()],
+            sorted(values),
+        )
+        self.assertEqual(qs.count(), 4)
+        self.assertEqual(qs.all()[1:].count(), 3)
+
+    def test_merge_reversed(self):
+        qs = NaiveDateTimeTieredModel.objects.all()
+        values = [obj.naive for obj in qs.reverse()]
+        self.assertEqual(len(values), 4)
+        self.assertEqual(values, sorted(values, reverse=True))
+        self.assertEqual(
+            list(qs.order_by("-naive").reverse().values_list("naive", flat=True)),
+            sorted(values),
+        )
+        self.assertEqual(qs.last().naive, values[0])
+        self.assertEqual(qs.order_by("-naive").last().naive, values[-1])
+
+    def test_merge_nulls(self):
+        # One row with and one without a rank in each tier
+        for alias in ("default", "archive"):
+            pk = NaiveDateTimeTieredModel.objects.using(alias).order_by("pk")[0].pk
+            NaiveDateTimeTieredModel.objects.using(alias).filter(pk=pk).update(
+                rank=1 if alias == "default" else 2
+            )
+        qs = NaiveDateTimeTieredModel.objects.all()
+        self.assertEqual(
+            list(qs.order_by("rank").values_list("rank", flat=True)),
+            [1, 2, None, None],
+        )
+        self.assertEqual(
+            [obj.rank for obj in qs.order_by("-rank")], [None, None, 2, 1]
+        )
+        self.assertEqual(
+            [obj.rank for obj in qs.order_by("rank").reverse()], [None, None, 2, 1]
+        )
+
+    def test_ordering_by_lookup(self):
+        with self.assertRaises(db.NotSupportedError):
+            list(NaiveDateTimeTieredModel.objects.order_by("naive__hour"))
+
+    def test_aggregate(self):
+        with self.assertRaises(db.NotSupportedError):
+            NaiveDateTimeTieredModel.objects.aggregate(models.Count("pk"))
+        self.assertEqual(
+            NaiveDateTimeTieredModel.objects.filter(
+                naive__gte=self.recent
+            ).aggregate(count=models.Count("pk")),
+            {"count": 2},
+        )
+
+    def test_save_and_delete(self):
+        obj = NaiveDateTimeTieredModel.objects.filter(naive__lte=self.old)[0]
+        obj.naive -= datetime.timedelta(days=1)
+        obj.save()
+        self.assertEqual(
+            NaiveDateTimeTieredModel.objects.using("archive").get(pk=obj.pk).naive,
+            obj.naive,
+        )
+        self.assertEqual(NaiveDateTimeTieredModel.objects.all().delete()[0], 4)
+
+    def test_router(self):
+        router = NaiveTieringRouter()
+        self.assertEqual(router.db_for_read(NaiveDateTimeTieredModel), "default")
+        self.assertIsNone(router.db_for_read(NaiveDateTimeTestModel))
+        self.assertTrue(
+            router.allow_migrate("archive", "tests", model=NaiveDateTimeTieredModel)
+        )
+
+
+class RollingWindowTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rows = [
+            ("A", datetime.datetime(2019, 1, 1, 10)),
+            ("A", datetime.datetime(2019, 1, 2, 9)),
+            ("A", datetime.datetime(2019, 1, 3, 10)),
+            ("A", datetime.datetime(2019, 1, 4, 10)),
+            ("A", datetime.datetime(2019, 1, 4, 18)),
+            ("B", datetime.datetime(2019, 1, 2, 12)),
+        ]
+        NaiveDateTimeTestModel.objects.bulk_create(
+            NaiveDateTimeTestModel(
+                timezone=tz, naive=dt, aware=timezone.make_aware(dt, pytz.utc)
+            )
+            for tz, dt in rows
+        )
+        # Rows within the two days before each one, boundary included
+        cls.expected = [1, 2, 3, 2, 3, 1]
+
+    def test_window(self):
+        qs = NaiveDateTimeTestModel.objects.annotate(
+            n=NaiveRollingWindow(
+                models.Count("pk"),
+                order_by="naive",
+                preceding=datetime.timedelta(days=2),
+                partition_by=["timezone"],
+            )
+        )
+        self.assertEqual([obj.n for obj in qs], self.expected)
+
+    def test_trunc(self):
+        day = naivedatetimefield.TruncDay("naive")
+        qs = (
+            NaiveDateTimeTestModel.objects.annotate(
+                day=day,
+                n=NaiveRollingWindow(
+                    models.Count("pk"),
+                    day,
+                    datetime.timedelta(days=1),
+                    ["timezone"],
+                ),
+            )
+            .values_list("timezone", "day", "n")
+            .order_by("timezone", "day")
+            .distinct()
+        )
+        self.assertEqual(
+            list(qs),
+            [
+                ("A", datetime.datetime(2019, 1, 1), 1),
+                ("A", datetime.datetime(2019, 1, 2), 2),
+                ("A", datetime.datetime(2019, 1, 3), 2),
+                ("A", datetime.datetime(2019, 1, 4), 3),
+                ("B", datetime.datetime(2019, 1, 2), 1),
+            ],
+        )
+
+    def test_subquery(self):
+        qs = NaiveDateTimeTestModel.objects.all()
+        qs = qs.annotate(
+            n=rolling_subquery(
+                qs,
+                models.Count("pk"),
+                "naive",
+                datetime.timedelta(days=2),
+                partition_by=["timezone"],
+            )
+        )
+        self.assertEqual([obj.n for obj in qs], self.expected)
+
+    @skipIf(connection.vendor != "sqlite", "SQLite stores timestamps as text")
+    def test_epoch_microseconds_sqlite(self):
+        values = [
+            "2019-01-15 02:00:00",
+            "2019-01-15 02:00:00.5",
+            "2019-01-15 02:00:00.250",
+            "2019-01-15 02:00:00.000001",
+        ]
+        epoch = datetime.datetime(2019, 1, 15, 2) - datetime.datetime(1970, 1, 1)
+        seconds = epoch // datetime.timedelta(seconds=1)
+        self.assertEqual(
+            [
+                NaiveDateTimeTestModel.objects.annotate(
+                    us=NaiveEpochMicroseconds(Value(value))
+                ).values_list("us", flat=True)[0]
+                - seconds * 1000000
+                for value in values
+            ],
+            [0, 500000, 250000, 1],
+        )
+
+    def test_negative_preceding(self):
+        with self.assertRaises(ValueError):
+            NaiveRollingWindow(
+                models.Count("pk"), "naive", datetime.timedelta(days=-1)
+            )
+
+
+class PurgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cutoff = datetime.datetime(2019, 1, 10)
+        NaiveDateTimeIndexedModel.objects.bulk_create(
+            NaiveDateTimeIndexedModel(naive=datetime.datetime(2019, 1, day, 12))
+            for day in (9, 1, 5, 5, 5, 10, 20)
+        )
+
+    def assertRemaining(self):
+        self.assertEqual(
+            list(
+                NaiveDateTimeIndexedModel.objects.order_by("naive").values_list(
+                    "naive", flat=True
+                )
+            ),
+            [datetime.datetime(2019, 1, 10, 12), datetime.datetime(2019, 1, 20, 12)],
+        )
+
+    def test_purge(self):
+        calls = []
+        # Each batch reads its keys and deletes them by pk in a savepoint,
+        # and the last one is partial so there is no empty batch.
+        with self.assertNumQueries(3 * 4):
+            deleted = purge(
+                NaiveDateTimeIndexedModel.objects.all(),
+                "naive",
+                self.cutoff,
+                batch_size=2,
+                progress=lambda deleted, rate: calls.append(deleted),
+            )
+        self.assertEqual(deleted, 5)
+        self.assertEqual(calls, [2, 4, 5])
+        self.assertRemaining()
+
+    def test_keyset_is_bounded(self):
+        with CaptureQueriesContext(connection) as queries:
+            purge(
+                NaiveDateTimeIndexedModel.objects.all(),
+                "naive",
+                self.cutoff,
+                batch_size=2,
+            )
+        selects = [query["sql"] for query in queries if query["sql"].startswith("SELECT")]
+        quote_name = connection.ops.quote_name
+        column = "%s.%s" % (
+            quote_name(NaiveDateTimeIndexedModel._meta.db_table),
+            quote_name("naive"),
+        )
+        self.assertIn(") AND %s >= " % column, selects[1])
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + selects[1])
+                plan = " ".join(str(row) for row in cursor.fetchall())
+            self.assertNotIn("MULTI-INDEX OR", plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_purge_signals(self):
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.naive)
+
+        db.models.signals.pre_delete.connect(
+            receiver, sender=NaiveDateTimeIndexedModel
+        )
+        self.addCleanup(
+            db.models.signals.pre_delete.disconnect,
+            receiver,
+            sender=NaiveDateTimeIndexedModel,
+        )
+        self.assertEqual(
+            purge(
+                NaiveDateTimeIndexedModel.objects.filter(naive__day__gt=1),
+                "naive",
+                self.cutoff,
+                batch_size=3,
+            ),
+            4,
+        )
+        self.assertEqual(len(deleted), 4)
+        self.assertEqual(NaiveDateTimeIndexedModel.objects.count(), 3)
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            "purge_naive",
+            "tests.NaiveDateTimeIndexedModel",
+            "naive",
+            "--before=2019-01-10 00:00",
+            "--batch-size=4",
+            stdout=out,
+        )
+        self.assertIn("Deleted 5 rows of tests.NaiveDateTimeIndexedModel", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+        self.assertRemaining()
+
+        with self.assertRaises(CommandError):
+            call_command(
+                "purge_naive", "tests.NaiveDateTimeIndexedModel", "aware", "--days=1"
+            )
+
+
+class ChangeExtractorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.objs = [NaiveDateTimeAutoNowModel.objects.create() for i in range(5)]
+        for obj, dt in zip(
+            cls.objs,
+            [
+                datetime.datetime(2019, 1, 1),
+                datetime.datetime(2019, 1, 1),
+                datetime.datetime(2019, 1, 2),
+                datetime.datetime(2019, 1, 3),
+            ],
+        ):
+            NaiveDateTimeAutoNowModel.objects.filter(pk=obj.pk).update(naive=dt)
+
+    def setUp(self):
+        self.extractor = ChangeExtractor(
+            NaiveDateTimeAutoNowModel.objects.all(),
+            "test",
+            "naive",
+            lag=datetime.timedelta(minutes=1),
+            chunk_size=2,
+        )
+
+    def poll(self):
+        return [[obj.pk for obj in chunk] for chunk in self.extractor.changes()]
+
+    def test_pending_is_bounded(self):
+        watermark = (datetime.datetime(2019, 1, 2), self.objs[2].pk)
+        sql = str(self.extractor.pending(watermark).query)
+        quote_name = connection.ops.quote_name
+        column = "%s.%s" % (
+            quote_name(NaiveDateTimeAutoNowModel._meta.db_table),
+            quote_name("naive"),
+        )
+        # ANDed with the OR of the keyset comparison
+        self.assertIn(") AND %s >= " % column, sql)
+        self.assertQuerysetEqual(
+            self.extractor.pending(watermark), self.objs[3:], transform=identity
+        )
+
+    def test_changes(self):
+        pks = [obj.pk for obj in self.objs]
+        # The last row was saved within the lag
+        self.assertEqual(self.poll(), [pks[0:2], pks[2:4]])
+        self.assertEqual(
+            self.extractor.load(), (datetime.datetime(2019, 1, 3), pks[3])
+        )
+        with self.assertNumQueries(2):
+            self.assertEqual(self.poll(), [])
+
+        ago = timezone.make_naive(timezone.now()) - datetime.timedelta(minutes=2)
+        NaiveDateTimeAutoNowModel.objects.filter(pk=pks[4]).update(naive=ago)
+        NaiveDateTimeAutoNowModel.objects.filter(pk=pks[1]).update(
+            naive=ago + datetime.timedelta(seconds=1)
+        )
+        self.assertEqual(self.poll(), [[pks[4], pks[1]]])
+
+    def test_watermark_not_moving(self):
+        # As if the stored values didn't compare with the watermark
+        self.extractor.pending = lambda watermark, until: (
+            NaiveDateTimeAutoNowModel.objects.order_by("naive", "pk")
+        )
+        changes = self.extractor.changes()
+        next(changes)
+        with self.assertRaises(ValueError):
+            next(changes)
+
+    def test_unfinished_chunk(self):
+        for chunk in self.extractor.changes():
+            break
+        self.assertIsNone(self.extractor.load())
+
+        for chunk in self.extractor.changes():
+            self.assertEqual(len(chunk), 2)
+            break
+        self.extractor.reset()
+        self.assertEqual(len(self.poll()), 2)
+
+    def test_consumers(self):
+        self.poll()
+        other = ChangeExtractor(
+            NaiveDateTimeAutoNowModel.objects.all(),
+            "other",
+            "naive",
+            lag=datetime.timedelta(minutes=1),
+        )
+        self.assertEqual(len(next(other.changes())), 4)